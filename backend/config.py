@@ -10,25 +10,51 @@ BASE_DIR = Path(__file__).resolve().parent
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen3:1.7b")
 
+# LLM semantic response cache
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))  # seconds
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.95"))  # cosine threshold
+
+# Max (estimated) tokens of conversation history sent with each request
+LLM_HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "1500"))
+
 # Whisper STT
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
 WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
 WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", str(os.cpu_count() or 4)))
+# Parallel transcriptions the model will serve; >1 only helps with several voice sessions at once
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", "1"))
 
 # Kokoro TTS
 TTS_VOICE = os.getenv("TTS_VOICE", "af_heart")
 TTS_LANG_CODE = os.getenv("TTS_LANG_CODE", "a")  # a=American, b=British
+# Send 32-bit float WAV (no int16 quantization, twice the bytes) instead of 16-bit PCM
+TTS_FLOAT_WAV = os.getenv("TTS_FLOAT_WAV", "").lower() in ("1", "true", "yes")
+# Threads synthesizing sentence batches of one long reply in parallel (0 or 1 = serially)
+TTS_SYNTH_WORKERS = int(os.getenv("TTS_SYNTH_WORKERS", str(min(2, os.cpu_count() or 1))))
 
 # ChromaDB
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", str(BASE_DIR / "data" / "chroma_db"))
+# Set to use a Chroma server (`chroma run --path data/chroma_db --port 8001`) instead of the embedded store
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))  # 8000 is the backend itself
 
 # Embeddings
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch" (sentence-transformers) or "onnx" (INT8 ONNX Runtime; needs optimum[onnxruntime])
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = Path(os.getenv("EMBEDDING_ONNX_DIR", str(BASE_DIR / "data" / "onnx_embedder")))
+EMBED_CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", str(BASE_DIR / "data" / "embed_cache.sqlite3")))
 
 # RAG
 RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "500"))
 RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "50"))
 RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+# Worker processes for document parsing/embedding (0 = ingest in-process)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Processes for extracting text from large PDFs (0 or 1 = extract serially)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
 
 # Sessions
 SESSIONS_DIR = BASE_DIR / "data" / "sessions"
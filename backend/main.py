@@ -1,23 +1,32 @@
 import asyncio
-import base64
 import json
 import logging
+import multiprocessing
+import os
+import struct
+import subprocess
+import tempfile
 import time
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+import orjson
+import psutil
 from pydantic import BaseModel
 
-from config import AUDIO_OUTPUT_DIR, OLLAMA_BASE_URL
+from config import AUDIO_OUTPUT_DIR, INGEST_WORKERS, OLLAMA_BASE_URL
 from pipeline.stt import stt_service
 from pipeline.llm import llm_service
 from pipeline.tts import tts_service
-from pipeline.rag import rag_service
+from pipeline.rag import rag_service, init_ingest_worker, prepare_upload
 from pipeline.sessions import session_manager
-from pipeline.orchestrator import get_orchestrator, remove_orchestrator
+from pipeline.orchestrator import get_orchestrator, remove_orchestrator, invalidate_docs_cache
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,25 +35,92 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# --- System status probes ---
+
+GPU_POLL_INTERVAL = 2.0  # seconds
+
+# Latest nvidia-smi snapshot, refreshed in the background so /api/status never forks
+_gpu_cache: dict = {"info": None}
+_probe_cache: dict[str, tuple[float, object]] = {}
+
+
+def _run_nvidia_smi() -> dict | None:
+    result = subprocess.run(
+        ["nvidia-smi", "--query-gpu=memory.used,memory.total,utilization.gpu",
+         "--format=csv,noheader,nounits"],
+        capture_output=True, text=True, timeout=5,
+    )
+    if result.returncode != 0:
+        return None
+    parts = result.stdout.strip().split(", ")
+    return {
+        "memory_used_mb": int(parts[0]),
+        "memory_total_mb": int(parts[1]),
+        "utilization_pct": int(parts[2]),
+    }
+
+
+async def _gpu_poller():
+    """Refresh the GPU snapshot every GPU_POLL_INTERVAL seconds."""
+    while True:
+        try:
+            _gpu_cache["info"] = await asyncio.to_thread(_run_nvidia_smi)
+        except FileNotFoundError:
+            logger.info("nvidia-smi not found; GPU stats disabled")
+            return
+        except Exception as e:
+            logger.debug("nvidia-smi failed: %s", e)
+            _gpu_cache["info"] = None
+        await asyncio.sleep(GPU_POLL_INTERVAL)
+
+
+def _cached_probe(name: str, ttl: float, fn):
+    """Return fn() memoized for ttl seconds under name."""
+    now = time.monotonic()
+    hit = _probe_cache.get(name)
+    if hit and hit[0] > now:
+        return hit[1]
+    value = fn()
+    _probe_cache[name] = (now + ttl, value)
+    return value
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize services on startup, cleanup on shutdown."""
     logger.info("Starting Voice RAG Assistant...")
 
-    # Load models (CPU-bound, run in thread pool)
+    # Load models concurrently in the thread pool; they are independent and mostly disk-bound
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, stt_service.load)
-    await loop.run_in_executor(None, rag_service.load)
-    await loop.run_in_executor(None, tts_service.load)
+    await asyncio.gather(
+        loop.run_in_executor(None, stt_service.load),
+        loop.run_in_executor(None, rag_service.load),
+        loop.run_in_executor(None, tts_service.load),
+    )
+
+    # Document ingestion (parse + embed) runs in worker processes, each holding its own
+    # embedder; spawn avoids forking a parent that already has torch threads running
+    app.state.ingest_pool = None
+    if INGEST_WORKERS > 0:
+        app.state.ingest_pool = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_ingest_worker,
+        )
 
     # Initialize async services
     await llm_service.initialize()
+    gpu_task = asyncio.create_task(_gpu_poller())
 
     logger.info("All services loaded. Ready.")
     yield
 
     # Cleanup
+    gpu_task.cancel()
+    if app.state.ingest_pool is not None:
+        app.state.ingest_pool.shutdown(wait=False, cancel_futures=True)
     await llm_service.close()
+    session_manager.close()
     logger.info("Shutdown complete.")
 
 
@@ -62,6 +138,76 @@ app.add_middleware(
 app.mount("/audio", StaticFiles(directory=str(AUDIO_OUTPUT_DIR)), name="audio")
 
 
+# --- Streaming helpers ---
+
+SSE_FLUSH_TOKENS = 16
+SSE_FLUSH_INTERVAL = 0.025  # seconds
+
+# Pre-encoded SSE framing; StreamingResponse passes bytes through unchanged
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+
+
+async def _coalesce_tokens(
+    source: AsyncIterator[str],
+    max_tokens: int = SSE_FLUSH_TOKENS,
+    max_delay: float = SSE_FLUSH_INTERVAL,
+) -> AsyncIterator[str]:
+    """Batch streamed tokens, flushing every max_tokens or max_delay seconds."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for token in source:
+                await queue.put(token)
+        finally:
+            await queue.put(done)
+
+    pump_task = asyncio.create_task(pump())
+    pending: list[str] = []
+    deadline = 0.0
+    try:
+        while True:
+            timeout = max(deadline - loop.time(), 0) if pending else None
+            try:
+                token = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "".join(pending)
+                pending.clear()
+                continue
+            if token is done:
+                break
+            if not pending:
+                deadline = loop.time() + max_delay
+            pending.append(token)
+            if len(pending) >= max_tokens:
+                yield "".join(pending)
+                pending.clear()
+        if pending:
+            yield "".join(pending)
+        await pump_task  # surface errors raised by the source stream
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+async def _spool_upload(file: UploadFile) -> tuple[str, int]:
+    """Copy an upload to a temp file in fixed-size chunks. Returns (path, size_bytes)."""
+    fd, path = tempfile.mkstemp(suffix=Path(file.filename or "").suffix)
+    size = 0
+    with os.fdopen(fd, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            out.write(chunk)
+            size += len(chunk)
+    return path, size
+
+
 # --- Pydantic models ---
 
 class ChatRequest(BaseModel):
@@ -143,7 +289,7 @@ async def delete_session(session_id: str):
         raise HTTPException(status_code=404, detail="Session not found")
     remove_orchestrator(session_id)
     try:
-        rag_service.delete_session_conversations(session_id)
+        await asyncio.to_thread(rag_service.delete_session_conversations, session_id)
     except Exception as e:
         logger.warning("Failed to delete session conversations: %s", e)
     return {"status": "deleted", "session_id": session_id}
@@ -154,7 +300,7 @@ async def delete_session(session_id: str):
 @app.get("/api/documents/{doc_id}/pages/{page_number}")
 async def get_document_page(doc_id: str, page_number: int):
     """Get the full text of a specific page from an ingested document."""
-    result = rag_service.get_page(doc_id, page_number)
+    result = await asyncio.to_thread(rag_service.get_page, doc_id, page_number)
     if not result:
         raise HTTPException(status_code=404, detail="Page not found")
     return result
@@ -193,14 +339,15 @@ async def chat(request: ChatRequest):
 
     if request.stream:
         async def event_stream():
-            async for token in orch.process_text_stream(
+            tokens = orch.process_text_stream(
                 message=request.message,
                 model=request.model,
                 temperature=request.temperature,
                 max_tokens=request.max_tokens,
-            ):
-                yield f"data: {json.dumps({'token': token})}\n\n"
-            yield "data: [DONE]\n\n"
+            )
+            async for text in _coalesce_tokens(tokens):
+                yield _SSE_PREFIX + orjson.dumps({"token": text}) + _SSE_SUFFIX
+            yield _SSE_DONE
 
         return StreamingResponse(event_stream(), media_type="text/event-stream")
 
@@ -228,14 +375,27 @@ async def upload_document(file: UploadFile = File(...), session_id: str | None =
             detail=f"Unsupported file type: {ext}. Allowed: {', '.join(allowed_ext)}",
         )
 
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Empty file")
-
+    upload_path, size = await _spool_upload(file)
+    loop = asyncio.get_running_loop()
     try:
-        doc_id, chunk_count = rag_service.ingest_bytes(data, file.filename, session_id=session_id or "")
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty file")
+        if app.state.ingest_pool is not None:
+            prepared = await loop.run_in_executor(
+                app.state.ingest_pool, prepare_upload, upload_path, file.filename, session_id or "",
+            )
+        else:
+            prepared = await loop.run_in_executor(
+                None, rag_service.prepare_file, upload_path, file.filename, session_id or "",
+            )
+        doc_id, chunk_count = await loop.run_in_executor(None, rag_service.store_prepared, prepared)
+        invalidate_docs_cache(session_id or None)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ingestion failed: {e}")
+    finally:
+        os.unlink(upload_path)
 
     return {"doc_id": doc_id, "chunks": chunk_count, "status": "ingested", "filename": file.filename}
 
@@ -249,9 +409,11 @@ async def list_documents(session_id: str | None = None):
 @app.delete("/api/documents/{doc_id}")
 async def delete_document(doc_id: str):
     """Remove a document from RAG."""
-    success = rag_service.delete_document(doc_id)
+    success = await asyncio.to_thread(rag_service.delete_document, doc_id)
     if not success:
         raise HTTPException(status_code=404, detail="Document not found")
+    # The owning session isn't known here, so drop every cached listing
+    invalidate_docs_cache()
     return {"status": "deleted", "doc_id": doc_id}
 
 
@@ -268,39 +430,18 @@ async def list_models():
 @app.get("/api/status")
 async def system_status():
     """System health check and resource usage."""
-    import shutil
-
-    gpu_info = None
-    try:
-        import subprocess
-        result = subprocess.run(
-            ["nvidia-smi", "--query-gpu=memory.used,memory.total,utilization.gpu",
-             "--format=csv,noheader,nounits"],
-            capture_output=True, text=True, timeout=5,
-        )
-        if result.returncode == 0:
-            parts = result.stdout.strip().split(", ")
-            gpu_info = {
-                "memory_used_mb": int(parts[0]),
-                "memory_total_mb": int(parts[1]),
-                "utilization_pct": int(parts[2]),
-            }
-    except Exception:
-        pass
-
-    disk = shutil.disk_usage("/")
-    import psutil
-    mem = psutil.virtual_memory() if hasattr(__import__("psutil"), "virtual_memory") else None
+    mem = _cached_probe("memory", 1.0, psutil.virtual_memory)
+    documents_count = _cached_probe("documents_count", 10.0, lambda: len(rag_service.list_documents()))
 
     status = {
         "status": "ok",
         "ollama_url": OLLAMA_BASE_URL,
-        "gpu": gpu_info,
+        "gpu": _gpu_cache["info"],
         "ram": {
             "used_gb": round(mem.used / 1e9, 1) if mem else None,
             "total_gb": round(mem.total / 1e9, 1) if mem else None,
         },
-        "documents_count": len(rag_service.list_documents()),
+        "documents_count": documents_count,
         "conversation_memory_count": rag_service.conv_collection.count(),
         "sessions_count": len(session_manager.list_all()),
     }
@@ -349,6 +490,20 @@ async def set_voice(update: VoiceUpdate):
 
 # --- WebSocket Voice Streaming ---
 
+WS_AUDIO_FRAME = 0x01
+_AUDIO_FRAME_HEADER = struct.Struct(">BI")
+
+
+async def _send_json(ws: WebSocket, obj: dict):
+    """Send a JSON control message, encoded with orjson instead of Starlette's json.dumps."""
+    await ws.send_text(orjson.dumps(obj).decode())
+
+
+def _audio_frame(wav_bytes: bytes, index: int) -> bytes:
+    """Binary audio frame: type byte, big-endian chunk index, then the WAV payload."""
+    return _AUDIO_FRAME_HEADER.pack(WS_AUDIO_FRAME, index) + wav_bytes
+
+
 @app.websocket("/ws/voice")
 async def websocket_voice(ws: WebSocket):
     """Real-time voice streaming endpoint.
@@ -356,7 +511,7 @@ async def websocket_voice(ws: WebSocket):
     Protocol:
     - Client sends binary audio frames (PCM16 16kHz mono)
     - Client sends JSON: {"type": "end", "session_id": "..."} to signal end of speech
-    - Server streams JSON: {"type": "audio_chunk", "data": "<base64 wav>", "index": N}
+    - Server streams binary audio frames: 0x01 | uint32 big-endian index | WAV bytes
     - Server sends JSON: {"type": "audio_done"} when all chunks sent
     """
     import asyncio
@@ -364,7 +519,7 @@ async def websocket_voice(ws: WebSocket):
     await ws.accept()
     logger.info("WebSocket voice connection opened")
 
-    audio_buffer = bytearray()
+    audio_chunks: list[bytes] = []
     cancel_event: asyncio.Event | None = None
     pipeline_task: asyncio.Task | None = None
 
@@ -376,14 +531,14 @@ async def websocket_voice(ws: WebSocket):
                 break
 
             if "bytes" in message:
-                audio_buffer.extend(message["bytes"])
+                audio_chunks.append(message["bytes"])
 
             elif "text" in message:
                 data = json.loads(message["text"])
 
-                if data.get("type") == "end" and audio_buffer:
-                    audio_bytes = bytes(audio_buffer)
-                    audio_buffer.clear()
+                if data.get("type") == "end" and audio_chunks:
+                    audio_bytes = b"".join(audio_chunks)
+                    audio_chunks.clear()
 
                     cancel_event = asyncio.Event()
 
@@ -393,18 +548,13 @@ async def websocket_voice(ws: WebSocket):
                     orch = get_orchestrator(session.session_id)
 
                     async def status_cb(stage: str):
-                        await ws.send_json({"type": "status", "stage": stage})
+                        await _send_json(ws, {"type": "status", "stage": stage})
 
                     async def transcript_cb(text: str):
-                        await ws.send_json({"type": "transcript", "text": text})
+                        await _send_json(ws, {"type": "transcript", "text": text})
 
                     async def audio_chunk_cb(wav_bytes: bytes, index: int):
-                        audio_b64 = base64.b64encode(wav_bytes).decode("ascii")
-                        await ws.send_json({
-                            "type": "audio_chunk",
-                            "data": audio_b64,
-                            "index": index,
-                        })
+                        await ws.send_bytes(_audio_frame(wav_bytes, index))
 
                     async def run_pipeline():
                         try:
@@ -422,7 +572,7 @@ async def websocket_voice(ws: WebSocket):
                             if not cancel_event.is_set():
                                 # Send full response text for chat display
                                 if result.get("response_text"):
-                                    await ws.send_json({
+                                    await _send_json(ws, {
                                         "type": "response",
                                         "text": result["response_text"],
                                         "timings": result["timings"],
@@ -430,12 +580,12 @@ async def websocket_voice(ws: WebSocket):
                                         "session_id": session.session_id,
                                     })
 
-                                await ws.send_json({"type": "audio_done"})
-                                await ws.send_json({"type": "status", "stage": "idle"})
+                                await _send_json(ws, {"type": "audio_done"})
+                                await _send_json(ws, {"type": "status", "stage": "idle"})
 
                         except Exception as e:
                             logger.error("Pipeline error: %s", e, exc_info=True)
-                            await ws.send_json({
+                            await _send_json(ws, {
                                 "type": "error",
                                 "message": str(e),
                             })
@@ -443,12 +593,12 @@ async def websocket_voice(ws: WebSocket):
                     pipeline_task = asyncio.create_task(run_pipeline())
 
                 elif data.get("type") == "cancel":
-                    audio_buffer.clear()
+                    audio_chunks.clear()
                     if cancel_event:
                         cancel_event.set()
                     if pipeline_task and not pipeline_task.done():
                         pipeline_task.cancel()
-                    await ws.send_json({"type": "status", "stage": "idle"})
+                    await _send_json(ws, {"type": "status", "stage": "idle"})
 
     except WebSocketDisconnect:
         logger.info("WebSocket voice connection closed")
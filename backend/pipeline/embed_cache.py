@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import numpy as np
+from config import EMBED_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default host-parameter limit is 999 on older builds
+_QUERY_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent SHA-256 -> embedding cache so unchanged chunks aren't re-embedded.
+
+    Vectors are stored as raw float32 bytes, keyed by (text hash, model name). The
+    connection is opened lazily so each ingest worker process gets its own.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " hash TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " vec BLOB NOT NULL,"
+                " PRIMARY KEY (hash, model))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, hashes: list[str], model: str) -> dict[str, np.ndarray]:
+        """Look up cached vectors for the given hashes. Misses are simply absent."""
+        found: dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), _QUERY_BATCH):
+                batch = unique[i:i + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, vec in rows:
+                    found[h] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, items: dict[str, np.ndarray], model: str):
+        """Store vectors for the given hashes in a single transaction."""
+        if not items:
+            return
+        rows = [
+            (h, model, np.ascontiguousarray(vec, dtype=np.float32).tobytes())
+            for h, vec in items.items()
+        ]
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, model, vec) VALUES (?, ?, ?)",
+                    rows,
+                )
+
+
+embedding_cache = EmbeddingCache(str(EMBED_CACHE_PATH))
@@ -1,9 +1,22 @@
 import asyncio
+import hashlib
+import json
 import logging
-import re
+import time
 from collections.abc import AsyncIterator
 import httpx
-from config import OLLAMA_BASE_URL, OLLAMA_MODEL
+import numpy as np
+import orjson
+from config import (
+    OLLAMA_BASE_URL,
+    OLLAMA_MODEL,
+    LLM_CACHE_SIZE,
+    LLM_CACHE_TTL,
+    LLM_CACHE_SIMILARITY,
+    LLM_HISTORY_TOKEN_BUDGET,
+)
+from pipeline.rag import rag_service
+from pipeline.sessions import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -16,20 +29,136 @@ Rules:
 - Never say "I don't understand" or "Could you clarify" — always try to contribute something useful.
 - Respond in plain sentences. No markdown, no bullet points, no code blocks, no emojis.
 - Keep responses concise — 1 to 3 sentences.
+- Messages starting with [doc ...] contain retrieved document text; use them to answer.
 - When citing documents, mention the source naturally (e.g. "On page three...").
 """
 
-MAX_RETRIES = 2
-RETRY_DELAY = 1.0
+MAX_RETRIES = 2  # app-level retries, for retryable 5xx responses only
+RETRY_DELAY = 0.25  # base delay, doubled per attempt
+CONNECT_RETRIES = 3  # transport-level retries for failed TCP connects
 _RETRYABLE_STATUS = {500, 502, 503}
 
-# Regex to strip <think>...</think> blocks from qwen3 output
-_THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
 
 
 def _strip_think_tags(text: str) -> str:
-    """Remove <think>...</think> blocks from LLM output."""
-    return _THINK_PATTERN.sub("", text).strip()
+    """Remove <think>...</think> blocks from qwen3 output.
+
+    Single forward scan; an unterminated <think> is kept verbatim.
+    """
+    if _THINK_OPEN not in text:
+        return text.strip()
+    parts = []
+    pos = 0
+    while (start := text.find(_THINK_OPEN, pos)) != -1:
+        end = text.find(_THINK_CLOSE, start + len(_THINK_OPEN))
+        if end == -1:
+            break
+        parts.append(text[pos:start])
+        pos = end + len(_THINK_CLOSE)
+    parts.append(text[pos:])
+    return "".join(parts).strip()
+
+
+def _trim_history(history: list[dict], budget: int) -> list[dict]:
+    """Keep the most recent messages that fit within budget tokens, oldest first."""
+    kept = []
+    used = 0
+    for entry in reversed(history):
+        tokens = entry.get("tokens") or estimate_tokens(entry["content"])
+        if used + tokens > budget:
+            break
+        used += tokens
+        kept.append({"role": entry["role"], "content": entry["content"]})
+    kept.reverse()
+    return kept
+
+
+async def _iter_ndjson(response: httpx.Response) -> AsyncIterator[dict]:
+    """Parse an NDJSON byte stream, carrying partial lines across network chunks."""
+    pending = bytearray()
+    async for raw in response.aiter_bytes():
+        pending += raw
+        start = 0
+        while (end := pending.find(b"\n", start)) != -1:
+            line = pending[start:end]
+            start = end + 1
+            if line.strip():
+                yield orjson.loads(line)
+        del pending[:start]
+    if pending.strip():
+        yield orjson.loads(pending)
+
+
+def _sorted_chunks(chunks: list[dict] | None) -> list[dict]:
+    """Order retrieved chunks by their stable id rather than by relevance score."""
+    return sorted(chunks or [], key=lambda c: c["id"])
+
+
+def _cache_key(
+    model: str,
+    temperature: float,
+    chunks: list[dict] | None,
+    conversation_history: list[dict] | None,
+) -> str:
+    """Stable key for everything besides the user message that shapes a response."""
+    context = json.dumps(_sorted_chunks(chunks), sort_keys=True, separators=(",", ":"))
+    history = json.dumps(conversation_history or [], sort_keys=True, separators=(",", ":"))
+    h = hashlib.sha256()
+    for part in (model, f"{round(temperature, 1):.1f}", context, history):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class SemanticCache:
+    """Small in-process cache of recent responses, matched by embedding similarity.
+
+    Entries are only compared against entries with the same config key, so a
+    paraphrased question hits only when model, temperature, context and history agree.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._vecs: np.ndarray | None = None  # (max_entries, dim) float32, unit-norm rows
+        self._keys: list[str | None] = [None] * max_entries
+        self._responses: list[str] = [""] * max_entries
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+
+    def get(self, key: str, embedding: np.ndarray) -> str | None:
+        if self._vecs is None:
+            return None
+        now = time.monotonic()
+        valid = np.fromiter((k == key for k in self._keys), dtype=bool, count=self.max_entries)
+        valid &= self._expires > now
+        if not valid.any():
+            return None
+        sims = self._vecs @ embedding
+        sims[~valid] = -1.0
+        best = int(sims.argmax())
+        if sims[best] < self.threshold:
+            return None
+        self._last_used[best] = now
+        return self._responses[best]
+
+    def put(self, key: str, embedding: np.ndarray, response: str):
+        if self.max_entries <= 0:
+            return
+        if self._vecs is None:
+            self._vecs = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+        now = time.monotonic()
+        # Reuse an expired slot if there is one, otherwise evict the least recently used
+        expired = np.flatnonzero(self._expires <= now)
+        slot = int(expired[0]) if expired.size else int(self._last_used.argmin())
+        self._vecs[slot] = embedding
+        self._keys[slot] = key
+        self._responses[slot] = response
+        self._expires[slot] = now + self.ttl
+        self._last_used[slot] = now
 
 
 class LLMService:
@@ -37,9 +166,24 @@ class LLMService:
         self.base_url = OLLAMA_BASE_URL
         self.model = OLLAMA_MODEL
         self._client: httpx.AsyncClient | None = None
+        self._cache = SemanticCache(LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_SIMILARITY)
 
     async def initialize(self):
-        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=120.0)
+        # Pool/HTTP-2 settings live on the transport; the client ignores them once one is given
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=32,
+                max_connections=64,
+                keepalive_expiry=60,
+            ),
+            retries=CONNECT_RETRIES,
+        )
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(120.0, connect=5.0),
+            transport=transport,
+        )
         logger.info("LLM client initialized: model=%s url=%s", self.model, self.base_url)
 
     async def close(self):
@@ -52,19 +196,45 @@ class LLMService:
             raise RuntimeError("LLM client not initialized. Call initialize() first.")
         return self._client
 
+    async def _cache_embedding(self, user_message: str) -> np.ndarray | None:
+        """Query embedding for the semantic cache, or None to send the request uncached.
+
+        The forward pass runs off the event loop, and a failing embedder never fails the request.
+        """
+        if self._cache.max_entries <= 0:
+            return None
+        try:
+            return await asyncio.to_thread(rag_service.embed, user_message)
+        except Exception as e:
+            logger.warning("Embedding for the LLM cache failed, sending uncached: %s", e)
+            return None
+
     async def generate(
         self,
         user_message: str,
-        context: str = "",
+        chunks: list[dict] | None = None,
         conversation_history: list[dict] | None = None,
         model: str | None = None,
         temperature: float = 0.7,
         max_tokens: int = 512,
     ) -> str:
-        """Generate a complete response (non-streaming) with retry on transient errors."""
-        messages = self._build_messages(user_message, context, conversation_history)
+        """Generate a complete response (non-streaming) with retry on transient 5xx errors.
+
+        Responses are served from the semantic cache when a near-identical question
+        was recently answered under the same model, temperature, context and history.
+        """
+        model = model or self.model
+        cache_key = _cache_key(model, temperature, chunks, conversation_history)
+        query_embedding = await self._cache_embedding(user_message)
+        if query_embedding is not None:
+            cached = self._cache.get(cache_key, query_embedding)
+            if cached is not None:
+                logger.info("LLM cache hit (%d chars)", len(cached))
+                return cached
+
+        messages = self._build_messages(user_message, chunks, conversation_history)
         payload = {
-            "model": model or self.model,
+            "model": model,
             "messages": messages,
             "stream": False,
             "think": False,
@@ -79,35 +249,30 @@ class LLMService:
                 response = await self.client.post("/api/chat", json=payload)
                 response.raise_for_status()
                 data = response.json()
-                return _strip_think_tags(data["message"]["content"])
+                text = _strip_think_tags(data["message"]["content"])
+                if text and query_embedding is not None:
+                    self._cache.put(cache_key, query_embedding, text)
+                return text
             except httpx.HTTPStatusError as e:
                 if e.response.status_code not in _RETRYABLE_STATUS or attempt == MAX_RETRIES:
                     raise
                 last_error = e
                 logger.warning("Ollama returned %d, retrying (%d/%d)...",
                                e.response.status_code, attempt + 1, MAX_RETRIES)
-                await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-            except (httpx.ConnectError, httpx.ReadError) as e:
-                if attempt == MAX_RETRIES:
-                    raise
-                last_error = e
-                logger.warning("Ollama connection error, retrying (%d/%d): %s",
-                               attempt + 1, MAX_RETRIES, e)
-                await asyncio.sleep(RETRY_DELAY * (attempt + 1))
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
         raise last_error  # type: ignore[misc]
 
     async def generate_stream(
         self,
         user_message: str,
-        context: str = "",
+        chunks: list[dict] | None = None,
         conversation_history: list[dict] | None = None,
         model: str | None = None,
         temperature: float = 0.7,
         max_tokens: int = 512,
     ) -> AsyncIterator[str]:
-        """Stream response tokens with retry on transient connection errors."""
-        import json as json_mod
-        messages = self._build_messages(user_message, context, conversation_history)
+        """Stream response tokens with retry on transient 5xx errors."""
+        messages = self._build_messages(user_message, chunks, conversation_history)
         payload = {
             "model": model or self.model,
             "messages": messages,
@@ -125,11 +290,9 @@ class LLMService:
                     "POST", "/api/chat", json=payload,
                 ) as response:
                     response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            chunk = json_mod.loads(line)
-                            if "message" in chunk and "content" in chunk["message"]:
-                                yield chunk["message"]["content"]
+                    async for data in _iter_ndjson(response):
+                        if "message" in data and "content" in data["message"]:
+                            yield data["message"]["content"]
                     return  # streaming completed successfully
             except httpx.HTTPStatusError as e:
                 if e.response.status_code not in _RETRYABLE_STATUS or attempt == MAX_RETRIES:
@@ -137,14 +300,7 @@ class LLMService:
                 last_error = e
                 logger.warning("Ollama stream returned %d, retrying (%d/%d)...",
                                e.response.status_code, attempt + 1, MAX_RETRIES)
-                await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-            except (httpx.ConnectError, httpx.ReadError) as e:
-                if attempt == MAX_RETRIES:
-                    raise
-                last_error = e
-                logger.warning("Ollama stream connection error, retrying (%d/%d): %s",
-                               attempt + 1, MAX_RETRIES, e)
-                await asyncio.sleep(RETRY_DELAY * (attempt + 1))
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
         raise last_error  # type: ignore[misc]
 
     async def unload_from_gpu(self):
@@ -176,25 +332,28 @@ class LLMService:
     def _build_messages(
         self,
         user_message: str,
-        context: str = "",
+        chunks: list[dict] | None = None,
         conversation_history: list[dict] | None = None,
     ) -> list[dict]:
+        """Assemble the chat so the system prompt and history form a stable prefix.
+
+        Retrieved chunks go in as separate system messages after the history, ordered
+        by stable id, with the bare question last. This lets Ollama reuse its prompt
+        KV-cache for the shared prefix across turns of the same session. History is
+        trimmed to the most recent LLM_HISTORY_TOKEN_BUDGET tokens.
+        """
         messages = [{"role": "system", "content": SYSTEM_PROMPT}]
 
         if conversation_history:
-            messages.extend(conversation_history)
+            messages.extend(_trim_history(conversation_history, LLM_HISTORY_TOKEN_BUDGET))
 
-        if context:
-            user_content = (
-                f"Use the following document text to answer my question.\n\n"
-                f"Document text:\n---\n{context}\n---\n\n"
-                f"My question: {user_message}"
-            )
-        else:
-            user_content = user_message
+        for chunk in _sorted_chunks(chunks):
+            messages.append({
+                "role": "system",
+                "content": f"[doc {chunk['id']}] {chunk['text']}",
+            })
 
-        messages.append({"role": "user", "content": user_content})
+        messages.append({"role": "user", "content": user_message})
         return messages
 
-
 llm_service = LLMService()
@@ -0,0 +1,85 @@
+import logging
+import platform
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_FILE = "model_quantized.onnx"
+# sentence-transformers' max_seq_length for the MiniLM family
+MAX_SEQ_LENGTH = 256
+
+
+def _hub_id(model_name: str) -> str:
+    """Resolve short sentence-transformers names ("all-MiniLM-L6-v2") to a Hub id."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def _export_quantized(model_name: str, out_dir: Path):
+    """One-time export of the model to ONNX plus dynamic INT8 quantization (needs optimum)."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info("Exporting %s to ONNX at %s (one-time)...", model_name, out_dir)
+    model = ORTModelForFeatureExtraction.from_pretrained(_hub_id(model_name), export=True)
+    model.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(_hub_id(model_name)).save_pretrained(out_dir)
+
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    else:
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    ORTQuantizer.from_pretrained(model).quantize(save_dir=out_dir, quantization_config=qconfig)
+    logger.info("ONNX INT8 export done")
+
+
+class OnnxEmbedder:
+    """INT8 ONNX Runtime drop-in for the SentenceTransformer.encode() calls RAGService makes.
+
+    Mean-pools token embeddings and L2-normalizes, matching the MiniLM
+    sentence-transformers pipeline (Transformer -> mean Pooling -> Normalize).
+    """
+
+    def __init__(self, model_name: str, model_dir: Path):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        if not (model_dir / QUANTIZED_FILE).exists():
+            _export_quantized(model_name, model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            str(model_dir / QUANTIZED_FILE), options, providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def encode(
+        self,
+        sentences: list[str],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """Embed sentences. Output is always unit-norm, as with the normalizing ST models."""
+        out = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            enc = self._tokenizer(
+                batch, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self._input_names}
+            hidden = self._session.run(None, feeds)[0]  # (batch, seq, dim)
+
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+
+        if not out:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(out)
@@ -1,8 +1,12 @@
 import asyncio
+import hashlib
 import logging
 import re
 import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from pathlib import Path
 from config import AUDIO_OUTPUT_DIR
 from pipeline.stt import stt_service
@@ -16,17 +20,39 @@ logger = logging.getLogger(__name__)
 # --- Page-read detection ---
 
 # Multiple patterns tried in order; first match wins.
-# Group layout: (page_num_g1, page_num_g2, page_num_g3, doc_hint_g4)
-_PAGE_REQUEST_RE = re.compile(
-    r'(?:'
-    r'(?:read|show|get|give|tell)(?:\s+me)?(?:\s+about)?\s+page\s+(?:number\s+)?(\d+)'  # g1
-    r'|what(?:\s+is|.s)\s+on\s+page\s+(?:number\s+)?(\d+)'                               # g2
-    r'|page\s+(?:number\s+)?(\d+).*?(?:read|show|get|content|text|what)'                  # g3 (page first, verb later)
-    r')'
-    r'(?:\s+(?:of|from|in)\s+(.+))?',                                                     # g4 doc hint
-    re.IGNORECASE,
+# Group layout: (page_num, doc_hint). Each pattern is matched against the
+# lowercased query, so no IGNORECASE. Gaps and the doc hint are length-bounded
+# so long transcripts can't trigger pathological backtracking.
+_DOC_HINT = r'(?:\s+(?:of|from|in)\s+([^\n]{1,80}))?'
+_PAGE_REQUEST_RES = (
+    # "read me page 3"
+    re.compile(r'(?:read|show|get|give|tell)(?:\s+me)?(?:\s+about)?\s+page\s+(?:number\s+)?(\d+)' + _DOC_HINT),
+    # "what's on page 3"
+    re.compile(r'what(?:\s+is|.s)\s+on\s+page\s+(?:number\s+)?(\d+)' + _DOC_HINT),
+    # "page 3, read it" (page first, verb later)
+    re.compile(r'page\s+(?:number\s+)?(\d+)[^.!?\n]{0,40}?(?:read|show|get|content|text|what)' + _DOC_HINT),
 )
 
+# --- Retrieval gating ---
+
+# Conversational fillers that never benefit from document/memory lookup
+_FILLER_WORDS = frozenset({
+    "ok", "okay", "thanks", "thank", "you", "yes", "yeah", "yep", "no", "nope",
+    "sure", "continue", "next", "go", "on", "hmm", "right", "cool", "great",
+    "got", "it", "alright", "fine",
+})
+_FILLER_MAX_TOKENS = 6
+
+
+def _needs_retrieval(query: str) -> bool:
+    """False for short utterances made up only of filler words ("ok thanks", "go on")."""
+    tokens = [t.strip(".,!?;:'\"") for t in query.lower().split()]
+    tokens = [t for t in tokens if t]
+    if not tokens:
+        return False
+    return len(tokens) >= _FILLER_MAX_TOKENS or not set(tokens) <= _FILLER_WORDS
+
+
 # --- Sentence buffer for streaming LLM→TTS ---
 
 _ABBREVIATIONS = frozenset({
@@ -34,72 +60,138 @@ _ABBREVIATIONS = frozenset({
     "Dept", "Est", "Fig", "Gen", "Gov", "Sgt", "Corp", "Inc", "Ltd", "Co",
     "vs", "etc", "approx", "dept", "est", "min", "max", "misc", "tech",
 })
+# Case-folded so "Dr."/"dr."/"DR." all hit with a single lookup
+_ABBREVIATIONS_LOWER = frozenset(a.lower() for a in _ABBREVIATIONS)
 
-# Sentence-ending punctuation followed by whitespace and uppercase/quote
-_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z"\u201C])')
-# Single-letter abbreviation pattern (e.g. "U." in "U.S.")
-_SINGLE_LETTER_ABBR_RE = re.compile(r'\b[A-Z]\.$')
-# Decimal number ending (e.g. "3." in "3.14")
-_DECIMAL_END_RE = re.compile(r'\d\.$')
 # Fallback split points for long buffers
 _CLAUSE_SPLIT_RE = re.compile(r'[,;:]\s+(?=[A-Za-z])')
 
 MIN_SENTENCE_LENGTH = 20
 MAX_BUFFER_LENGTH = 500
 
+# LLM tokens are fed to the sentence buffer in small batches: every N tokens
+# or once this many seconds have passed since the last feed
+SENTENCE_BATCH_TOKENS = 4
+SENTENCE_BATCH_INTERVAL = 0.02
+# Piece size when splitting a complete text with split_sentences()
+_SPLIT_FEED_CHARS = 100
+# Max sentences waiting for TTS in the streaming voice pipeline
+SENTENCE_QUEUE_SIZE = 2
+# Concurrent TTS jobs; lets the next sentence synthesize while one is sent
+TTS_WORKERS = 2
+
+_tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+# How long an orchestrator reuses its session's document list
+DOCS_CACHE_TTL = 5.0
+
+
+def _discard_future(future: asyncio.Future):
+    """Drop a future nobody will await without asyncio logging its exception as never retrieved."""
+    if not future.cancel():
+        future.exception()  # already finished: retrieving the exception marks it handled
+
+
+def _skips_split(buf: str, period: int) -> bool:
+    """Whether the period at buf[period] should not end a sentence: it follows an
+    abbreviation ("Dr."), a single-letter abbreviation ("U." in "U.S.") or a
+    decimal number ("3." in "3.14").
+
+    Walks back over the word before the period (word chars as in regex \\w)
+    instead of running a regex over the whole candidate.
+    """
+    start = period
+    while start > 0 and (buf[start - 1].isalnum() or buf[start - 1] == "_"):
+        start -= 1
+    if start == period:
+        return False
+    word = buf[start:period]
+    return (
+        word.lower() in _ABBREVIATIONS_LOWER
+        or word[-1].isdecimal()
+        or (len(word) == 1 and "A" <= word <= "Z")
+    )
+
+
+def _find_sentence_end(buf: str, start: int) -> tuple[int, int] | None:
+    """Find sentence-ending punctuation followed by whitespace and an uppercase
+    letter/quote, for a boundary whose whitespace begins at or after start.
+
+    Returns (index of the punctuation, index just past the whitespace run where
+    the next sentence begins), or None if there is no boundary yet.
+    """
+    n = len(buf)
+    i = start - 1 if start > 0 else 0
+    while i < n - 1:
+        if buf[i] in ".!?" and buf[i + 1].isspace():
+            j = i + 2
+            while j < n and buf[j].isspace():
+                j += 1
+            if j < n and ("A" <= buf[j] <= "Z" or buf[j] == '"' or buf[j] == "\u201C"):
+                return i, j
+            i = j
+        else:
+            i += 1
+    return None
+
 
 class SentenceBuffer:
     """Accumulates streaming LLM tokens and yields complete sentences."""
 
     def __init__(self):
         self._buffer = ""
+        # No sentence boundary can start before this index of the current buffer,
+        # so each add() only rescans the tail instead of the whole buffer.
+        self._scanned_upto = 0
 
     def add(self, token: str) -> list[str]:
         """Add a token, return list of complete sentences (may be empty)."""
         self._buffer += token
         sentences = []
 
-        # Split on paragraph breaks first
-        while "\n\n" in self._buffer:
-            before, after = self._buffer.split("\n\n", 1)
-            sentence = before.strip()
-            self._buffer = after
+        # Split on paragraph breaks first. Any earlier break was already split
+        # off, so a new one can only start in the unscanned tail.
+        idx = self._buffer.find("\n\n", self._scanned_upto)
+        while idx != -1:
+            sentence = self._buffer[:idx].strip()
+            self._buffer = self._buffer[idx + 2:]
+            self._scanned_upto = 0
             if sentence:
                 sentences.append(sentence)
+            idx = self._buffer.find("\n\n")
 
         # Split on sentence-ending punctuation
         # Use search_start to skip past false positives (abbreviations, short fragments)
-        search_start = 0
+        search_start = self._scanned_upto
         while True:
-            match = _SENTENCE_END_RE.search(self._buffer, search_start)
-            if not match:
+            boundary = _find_sentence_end(self._buffer, search_start)
+            if boundary is None:
+                # A future boundary needs a new uppercase char after the trailing
+                # whitespace run, so it can start no earlier than that run.
+                tail = len(self._buffer)
+                while tail > search_start and self._buffer[tail - 1].isspace():
+                    tail -= 1
+                self._scanned_upto = tail
                 break
 
-            candidate = self._buffer[:match.start()].strip()
-
-            # Check for abbreviations — skip this split, try next
-            last_word_match = re.search(r'(\w+)\.$', candidate)
-            if last_word_match and last_word_match.group(1) in _ABBREVIATIONS:
-                search_start = match.end()
-                continue
+            punct, end = boundary
 
-            # Check for single-letter abbreviation (U.S., A.I.)
-            if _SINGLE_LETTER_ABBR_RE.search(candidate):
-                search_start = match.end()
+            # Abbreviation, single-letter abbreviation (U.S., A.I.) or
+            # decimal number (3.14) — skip this split, try next
+            if self._buffer[punct] == "." and _skips_split(self._buffer, punct):
+                search_start = end
                 continue
 
-            # Check for decimal number (3.14)
-            if _DECIMAL_END_RE.search(candidate):
-                search_start = match.end()
-                continue
+            # The whitespace before end is stripped along with the rest
+            candidate = self._buffer[:end].strip()
 
             # Too short — skip, will merge with next sentence
             if len(candidate) < MIN_SENTENCE_LENGTH:
-                search_start = match.end()
+                search_start = end
                 continue
 
             sentences.append(candidate)
-            self._buffer = self._buffer[match.end():]
+            self._buffer = self._buffer[end:]
             search_start = 0  # Reset for next search on updated buffer
 
         # Force-split if buffer is too long (LLM producing a run-on)
@@ -110,6 +202,7 @@ class SentenceBuffer:
                 split_pos = last_match.start() + 1  # Include the comma/semicolon
                 sentence = self._buffer[:split_pos].strip()
                 self._buffer = self._buffer[last_match.end():]
+                self._scanned_upto = 0
                 if sentence:
                     sentences.append(sentence)
 
@@ -119,13 +212,41 @@ class SentenceBuffer:
         """Return any remaining text as a final sentence."""
         remaining = self._buffer.strip()
         self._buffer = ""
+        self._scanned_upto = 0
         return remaining if remaining else None
 
 
+def split_sentences(text: str) -> list[str]:
+    """Split a complete text into TTS-sized sentences, using the same rules as SentenceBuffer.
+
+    Whitespace is normalized and the text is fed in a few word-aligned pieces
+    (well under MAX_BUFFER_LENGTH, so run-ons are still force-split) rather
+    than word by word.
+    """
+    normalized = " ".join(text.split()) + " "
+    buf = SentenceBuffer()
+    sentences = []
+    pos = 0
+    while pos < len(normalized) - 1:
+        end = normalized.find(" ", pos + _SPLIT_FEED_CHARS)
+        if end == -1:
+            end = len(normalized) - 1
+        sentences.extend(buf.add(normalized[pos:end + 1]))
+        pos = end + 1
+    remaining = buf.flush()
+    if remaining:
+        sentences.append(remaining)
+    return sentences
+
+
 class PipelineOrchestrator:
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.max_history = 10
+        # (fetched_at, docs) from rag_service.list_documents for this session
+        self._docs_cache: tuple[float, list[dict]] | None = None
+        # Strong refs to fire-and-forget tasks so they aren't garbage-collected mid-run
+        self._bg_tasks: set[asyncio.Task] = set()
 
     @property
     def rag_enabled(self) -> bool:
@@ -142,22 +263,52 @@ class PipelineOrchestrator:
     def _append_history(self, role: str, content: str):
         session_manager.append_history(self.session_id, role, content)
 
+    def _session_docs(self) -> list[dict]:
+        """This session's documents, reused for DOCS_CACHE_TTL seconds."""
+        now = time.monotonic()
+        if self._docs_cache and now - self._docs_cache[0] < DOCS_CACHE_TTL:
+            return self._docs_cache[1]
+        docs = rag_service.list_documents(session_id=self.session_id)
+        self._docs_cache = (now, docs)
+        return docs
+
+    def invalidate_docs_cache(self):
+        """Drop the cached document list (call after uploads/deletes)."""
+        self._docs_cache = None
+
+    def _store_conversation_later(self, user_text: str, assistant_text: str):
+        """Store an exchange in conversation memory without holding up the response."""
+        task = asyncio.create_task(asyncio.to_thread(
+            rag_service.store_conversation, user_text, assistant_text, session_id=self.session_id,
+        ))
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._on_bg_task_done)
+
+    def _on_bg_task_done(self, task: asyncio.Task):
+        self._bg_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Failed to store conversation memory: %s", task.exception())
+
     def _detect_page_request(self, query: str) -> tuple[int, str | None] | None:
         """Detect if the user is asking to read a specific page. Returns (page_number, doc_name_hint) or None."""
-        match = _PAGE_REQUEST_RE.search(query)
-        if match:
-            # Page number is in group 1, 2, or 3 (whichever branch matched)
-            page_str = match.group(1) or match.group(2) or match.group(3)
-            if not page_str:
-                return None
-            page_num = int(page_str)
-            doc_hint = match.group(4).strip() if match.group(4) else None
-            return page_num, doc_hint
+        q = query.lower()
+        # Every pattern needs the word "page"; most utterances never get to the regex
+        if "page" not in q:
+            return None
+        for pattern in _PAGE_REQUEST_RES:
+            match = pattern.search(q)
+            if match:
+                page_num = int(match.group(1))
+                doc_hint = match.group(2).strip() if match.group(2) else None
+                return page_num, doc_hint
         return None
 
-    def _fetch_page(self, page_num: int, doc_hint: str | None) -> tuple[str, list[dict]] | None:
+    def _fetch_page(
+        self, page_num: int, doc_hint: str | None, session_docs: list[dict] | None = None,
+    ) -> tuple[str, list[dict]] | None:
         """Fetch a full page by number. Resolves document by hint or falls back to session docs."""
-        session_docs = rag_service.list_documents(session_id=self.session_id)
+        if session_docs is None:
+            session_docs = self._session_docs()
         if not session_docs:
             return None
 
@@ -200,15 +351,15 @@ class PipelineOrchestrator:
         }]
         return context, sources
 
-    def _try_direct_page_read(self, query: str) -> dict | None:
+    def _try_direct_page_read(self, query: str, session_docs: list[dict] | None = None) -> dict | None:
         """If the query is a page-read request, return the page text directly (bypass LLM).
-        Returns {"text": ..., "sources": [...]} or None.
+        Pass session_docs if already fetched. Returns {"text": ..., "sources": [...]} or None.
         """
         page_req = self._detect_page_request(query)
         if not page_req:
             return None
         page_num, doc_hint = page_req
-        result = self._fetch_page(page_num, doc_hint)
+        result = self._fetch_page(page_num, doc_hint, session_docs)
         if not result:
             return None
         page_text, sources = result
@@ -216,55 +367,73 @@ class PipelineOrchestrator:
         text = page_text.split("\n", 1)[1] if "\n" in page_text else page_text
         return {"text": text, "sources": sources}
 
-    def _build_context(self, query: str) -> tuple[str, list[dict]]:
-        """Build RAG context and collect source citations.
-        Returns (context_string, sources_list).
+    async def _direct_page_read(self, query: str, session_docs: list[dict] | None = None) -> dict | None:
+        """_try_direct_page_read off the event loop: the page lookup is a Chroma call, an HTTP
+        round-trip with CHROMA_HOST. Queries that aren't page requests skip the thread hop.
         """
-        if not self.rag_enabled:
-            return "", []
+        if not self._detect_page_request(query):
+            return None
+        return await asyncio.to_thread(self._try_direct_page_read, query, session_docs)
 
-        # Try page-level retrieval first (full pages = better context for small models)
-        page_results = rag_service.retrieve_pages(query, k=3, session_id=self.session_id)
+    async def _build_context(self, query: str) -> tuple[list[dict], list[dict]]:
+        """Build RAG context chunks and collect source citations.
+        Returns (chunks, sources_list); each chunk is {"id": stable_id, "text": labeled_text}.
+        """
+        if not self.rag_enabled or not _needs_retrieval(query):
+            return [], []
+
+        # Embed once up front so the concurrent lookups below share the memoized
+        # query embedding instead of each computing it
+        await asyncio.to_thread(rag_service.embed, query)
+
+        # Try page-level retrieval first (full pages = better context for small models),
+        # alongside the conversation-memory lookup
+        page_results, conv_chunks = await asyncio.gather(
+            asyncio.to_thread(rag_service.retrieve_pages, query, k=3, session_id=self.session_id),
+            asyncio.to_thread(rag_service.retrieve_conversations, query, session_id=self.session_id),
+        )
         if page_results:
             doc_results = page_results
         else:
             # Fall back to chunk-level for plain text docs without page structure
-            doc_results = rag_service.retrieve(query, session_id=self.session_id)
-
-        conv_chunks = rag_service.retrieve_conversations(query, session_id=self.session_id)
+            doc_results = await asyncio.to_thread(rag_service.retrieve, query, session_id=self.session_id)
 
-        parts = []
+        chunks = []
         sources = []
         seen_sources = set()
 
-        if doc_results:
-            doc_parts = []
-            for chunk in doc_results:
-                page_num = chunk.get("page_number", -1)
-                filename = chunk.get("filename", "")
-                label = f"[Source: {filename}"
-                if page_num >= 0:
-                    label += f", page {page_num}"
-                label += "]"
-                doc_parts.append(f"{label}\n{chunk['text']}")
-
-                # Deduplicate sources
-                source_key = (chunk.get("doc_id", ""), page_num)
-                if source_key not in seen_sources:
-                    seen_sources.add(source_key)
-                    sources.append({
-                        "filename": filename,
-                        "page_number": page_num if page_num >= 0 else None,
-                        "doc_id": chunk.get("doc_id", ""),
-                    })
-
-            parts.append("Document context:\n" + "\n---\n".join(doc_parts))
-
-        if conv_chunks:
-            parts.append("Previous conversations:\n" + "\n---\n".join(conv_chunks))
-
-        context = "\n\n".join(parts)
-        return context, sources
+        for chunk in doc_results:
+            doc_id = chunk.get("doc_id", "")
+            page_num = chunk.get("page_number", -1)
+            filename = chunk.get("filename", "")
+            label = f"[Source: {filename}"
+            if page_num >= 0:
+                label += f", page {page_num}"
+            label += "]"
+            chunks.append({
+                "id": f"{doc_id}:{page_num:05d}:{chunk.get('chunk_index', 0):05d}",
+                "text": f"{label}\n{chunk['text']}",
+            })
+
+            # Deduplicate sources
+            source_key = (doc_id, page_num)
+            if source_key not in seen_sources:
+                seen_sources.add(source_key)
+                sources.append({
+                    "filename": filename,
+                    "page_number": page_num if page_num >= 0 else None,
+                    "doc_id": doc_id,
+                })
+
+        for exchange in conv_chunks:
+            # Content-derived id keeps the same exchange at the same position across turns
+            exchange_id = hashlib.sha1(exchange.encode("utf-8")).hexdigest()[:12]
+            chunks.append({
+                "id": f"conversation:{exchange_id}",
+                "text": f"[Previous conversation]\n{exchange}",
+            })
+
+        return chunks, sources
 
     async def process_voice(
         self,
@@ -280,9 +449,9 @@ class PipelineOrchestrator:
         # 1. STT
         if status_callback:
             await status_callback("transcribing")
-        t0 = time.time()
-        transcript, duration = stt_service.transcribe_bytes(audio_bytes)
-        timings["stt_ms"] = int((time.time() - t0) * 1000)
+        t0 = time.perf_counter_ns()
+        transcript, duration = await asyncio.to_thread(stt_service.transcribe_bytes, audio_bytes)
+        timings["stt_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
         logger.info("STT: '%s' (%.1fs audio, %dms)", transcript, duration, timings["stt_ms"])
 
         if not transcript.strip():
@@ -297,61 +466,57 @@ class PipelineOrchestrator:
         # 2. Check for direct page read (bypass LLM)
         if status_callback:
             await status_callback("retrieving")
-        t0 = time.time()
-        direct = self._try_direct_page_read(transcript)
+        t0 = time.perf_counter_ns()
+        direct = await self._direct_page_read(transcript)
         if direct:
             response_text = direct["text"]
             sources = direct["sources"]
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
             timings["llm_ms"] = 0
             logger.info("Direct page read: %d chars", len(response_text))
         else:
             # 2b. RAG retrieval
-            context, sources = self._build_context(transcript)
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            chunks, sources = await self._build_context(transcript)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
 
             # 3. LLM generation
             if status_callback:
                 await status_callback("thinking")
-            t0 = time.time()
+            t0 = time.perf_counter_ns()
             response_text = await llm_service.generate(
                 user_message=transcript,
-                context=context,
+                chunks=chunks,
                 conversation_history=self._get_history(),
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
-            timings["llm_ms"] = int((time.time() - t0) * 1000)
+            timings["llm_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
             logger.info("LLM: %d chars, %dms", len(response_text), timings["llm_ms"])
 
         # 4. TTS
         if status_callback:
             await status_callback("speaking")
-        t0 = time.time()
-        audio_wav = tts_service.synthesize(response_text)
-        timings["tts_ms"] = int((time.time() - t0) * 1000)
+        t0 = time.perf_counter_ns()
+        audio_wav = await asyncio.to_thread(tts_service.synthesize, response_text)
+        timings["tts_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
         logger.info("TTS: %d bytes, %dms", len(audio_wav), timings["tts_ms"])
 
         # Save audio to file
-        audio_id = str(uuid.uuid4())
+        audio_id = uuid.uuid4().hex
         audio_path = AUDIO_OUTPUT_DIR / f"{audio_id}.wav"
-        audio_path.write_bytes(audio_wav)
+        await asyncio.to_thread(audio_path.write_bytes, audio_wav)
 
         # 5. Update conversation history and memory
         self._append_history("user", transcript)
         self._append_history("assistant", response_text)
 
-        try:
-            rag_service.store_conversation(transcript, response_text, session_id=self.session_id)
-        except Exception as e:
-            logger.warning("Failed to store conversation memory: %s", e)
+        self._store_conversation_later(transcript, response_text)
 
         return {
             "transcript": transcript,
             "response_text": response_text,
             "audio_url": f"/audio/{audio_id}.wav",
-            "audio_bytes": audio_wav,
             "timings": timings,
             "sources": sources,
         }
@@ -369,19 +534,32 @@ class PipelineOrchestrator:
     ) -> dict:
         """Streaming voice pipeline: STT → RAG → LLM stream → sentence TTS → audio chunks."""
         timings = {}
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
+
+        # Fetch the session's documents for page-read detection while STT runs.
+        # run_in_executor submits immediately, so this overlaps the STT thread.
+        docs_future = loop.run_in_executor(None, self._session_docs)
 
         # 1. STT
-        if status_callback:
-            await status_callback("transcribing")
-        t0 = time.time()
-        transcript, duration = stt_service.transcribe_bytes(audio_bytes)
-        timings["stt_ms"] = int((time.time() - t0) * 1000)
+        try:
+            if status_callback:
+                await status_callback("transcribing")
+            t0 = time.perf_counter_ns()
+            transcript, duration = await asyncio.to_thread(stt_service.transcribe_bytes, audio_bytes)
+        except BaseException:
+            _discard_future(docs_future)
+            raise
+        timings["stt_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
         logger.info("STT: '%s' (%.1fs audio, %dms)", transcript, duration, timings["stt_ms"])
 
         if not transcript.strip():
+            _discard_future(docs_future)
             return {"transcript": "", "response_text": "", "timings": timings, "sources": []}
 
+        # Snapshot history before any awaits; it's an in-memory slice, cheaper
+        # inline than handed to a thread
+        history = self._get_history()
+
         # Send transcript immediately so user sees it in the UI
         if transcript_callback:
             await transcript_callback(transcript)
@@ -389,14 +567,14 @@ class PipelineOrchestrator:
         # 2. Check for direct page read (bypass LLM)
         if status_callback:
             await status_callback("retrieving")
-        t0 = time.time()
-        direct = self._try_direct_page_read(transcript)
+        t0 = time.perf_counter_ns()
+        direct = await self._direct_page_read(transcript, session_docs=await docs_future)
 
         if direct:
-            # Direct page read — feed page text through SentenceBuffer → TTS
+            # Direct page read — split page text into sentences → TTS
             full_response = direct["text"]
             sources = direct["sources"]
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
             timings["llm_ms"] = 0
             logger.info("Direct page read (stream): %d chars", len(full_response))
 
@@ -404,52 +582,38 @@ class PipelineOrchestrator:
                 await status_callback("speaking")
 
             chunk_index = 0
-            tts_start = time.time()
-            buf = SentenceBuffer()
-            # Feed the text word-by-word through SentenceBuffer to get natural TTS chunks
-            for word in full_response.split():
+            tts_start = time.perf_counter_ns()
+            for sentence in split_sentences(full_response):
                 if cancel_event and cancel_event.is_set():
                     break
-                for sentence in buf.add(word + " "):
-                    try:
-                        wav_bytes = await loop.run_in_executor(
-                            None, tts_service.synthesize, sentence
-                        )
-                        if audio_chunk_callback:
-                            await audio_chunk_callback(wav_bytes, chunk_index)
-                        chunk_index += 1
-                    except Exception as e:
-                        logger.error("TTS failed for chunk %d: %s", chunk_index, e)
-                        chunk_index += 1
-
-            remaining = buf.flush()
-            if remaining:
                 try:
                     wav_bytes = await loop.run_in_executor(
-                        None, tts_service.synthesize, remaining
+                        _tts_executor, tts_service.synthesize, sentence
                     )
                     if audio_chunk_callback:
                         await audio_chunk_callback(wav_bytes, chunk_index)
-                    chunk_index += 1
                 except Exception as e:
-                    logger.error("TTS failed for final chunk: %s", e)
+                    logger.error("TTS failed for chunk %d: %s", chunk_index, e)
+                chunk_index += 1
 
-            timings["tts_first_chunk_ms"] = int((time.time() - tts_start) * 1000)
+            timings["tts_first_chunk_ms"] = (time.perf_counter_ns() - tts_start) // 1_000_000
             timings["tts_chunks"] = chunk_index
 
         else:
             # Normal flow: RAG retrieval → streaming LLM → TTS
-            context, sources = self._build_context(transcript)
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            chunks, sources = await self._build_context(transcript)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
 
             # 3. Streaming LLM → sentence buffer → TTS → audio chunks
             if status_callback:
                 await status_callback("thinking")
 
-            sentence_queue: asyncio.Queue[str | None] = asyncio.Queue()
+            # Bounded so a fast LLM can't run far ahead of TTS; a barge-in then
+            # only has a couple of queued sentences to throw away
+            sentence_queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=SENTENCE_QUEUE_SIZE)
             full_response = ""
             chunk_index = 0
-            llm_start = time.time()
+            llm_start = time.perf_counter_ns()
             first_token_time = None
             first_chunk_time = None
 
@@ -457,63 +621,114 @@ class PipelineOrchestrator:
                 """Stream LLM tokens, buffer into sentences, enqueue."""
                 nonlocal full_response, first_token_time
                 buf = SentenceBuffer()
-                async for token in llm_service.generate_stream(
+                pending: list[str] = []
+                last_feed = time.monotonic()
+                # aclosing: breaking out (barge-in) or being cancelled closes the Ollama
+                # response right away instead of whenever the generator is collected
+                async with aclosing(llm_service.generate_stream(
                     user_message=transcript,
-                    context=context,
-                    conversation_history=self._get_history(),
+                    chunks=chunks,
+                    conversation_history=history,
                     model=model,
                     temperature=temperature,
                     max_tokens=max_tokens,
-                ):
-                    if cancel_event and cancel_event.is_set():
-                        return
-                    if first_token_time is None:
-                        first_token_time = time.time()
-                    full_response += token
-                    for sentence in buf.add(token):
-                        await sentence_queue.put(sentence)
-
-                remaining = buf.flush()
-                if remaining:
-                    await sentence_queue.put(remaining)
+                )) as tokens:
+                    async for token in tokens:
+                        if cancel_event and cancel_event.is_set():
+                            break
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter_ns()
+                        full_response += token
+                        pending.append(token)
+                        now = time.monotonic()
+                        if len(pending) >= SENTENCE_BATCH_TOKENS or now - last_feed >= SENTENCE_BATCH_INTERVAL:
+                            for sentence in buf.add("".join(pending)):
+                                await sentence_queue.put(sentence)
+                            pending.clear()
+                            last_feed = now
+
+                if not (cancel_event and cancel_event.is_set()):
+                    if pending:
+                        for sentence in buf.add("".join(pending)):
+                            await sentence_queue.put(sentence)
+                    remaining = buf.flush()
+                    if remaining:
+                        await sentence_queue.put(remaining)
+                # Always sent, even on cancel, so the consumer never waits forever
                 await sentence_queue.put(None)  # sentinel
 
+            # In-flight TTS jobs in sentence order, so the next sentence is already
+            # synthesizing while the previous one is being sent
+            synth_queue: asyncio.Queue[asyncio.Future | None] = asyncio.Queue(maxsize=TTS_WORKERS)
+
             async def consume_sentences():
-                """Dequeue sentences, synthesize in thread pool, send audio chunks."""
-                nonlocal chunk_index, first_chunk_time
+                """Dequeue sentences and start their synthesis on the TTS pool."""
+                speaking = False
                 while True:
                     sentence = await sentence_queue.get()
                     if sentence is None:
                         break
                     if cancel_event and cancel_event.is_set():
+                        # Barge-in: discard what's queued instead of synthesizing it,
+                        # reading up to the sentinel so the producer never blocks on put
+                        while sentence is not None:
+                            sentence = await sentence_queue.get()
                         break
 
-                    if status_callback and chunk_index == 0:
+                    if status_callback and not speaking:
+                        speaking = True
                         await status_callback("speaking")
 
+                    await synth_queue.put(
+                        loop.run_in_executor(_tts_executor, tts_service.synthesize, sentence)
+                    )
+                await synth_queue.put(None)  # sentinel
+
+            async def emit_audio():
+                """Await synthesized chunks in order and send them."""
+                nonlocal chunk_index, first_chunk_time
+                while True:
+                    job = await synth_queue.get()
+                    if job is None:
+                        break
                     try:
-                        wav_bytes = await loop.run_in_executor(
-                            None, tts_service.synthesize, sentence
-                        )
-                        if first_chunk_time is None:
-                            first_chunk_time = time.time()
-                        if audio_chunk_callback:
-                            await audio_chunk_callback(wav_bytes, chunk_index)
-                        chunk_index += 1
+                        wav_bytes = await job
+                        # Still await every job, but don't send audio after a barge-in
+                        if not (cancel_event and cancel_event.is_set()):
+                            if first_chunk_time is None:
+                                first_chunk_time = time.perf_counter_ns()
+                            if audio_chunk_callback:
+                                await audio_chunk_callback(wav_bytes, chunk_index)
                     except Exception as e:
                         logger.error("TTS failed for chunk %d: %s", chunk_index, e)
-                        chunk_index += 1
-
-            producer = asyncio.create_task(produce_sentences())
-            consumer = asyncio.create_task(consume_sentences())
-            await asyncio.gather(producer, consumer)
-
-            total_time = time.time() - llm_start
-            timings["llm_ms"] = int(total_time * 1000)
-            if first_token_time:
-                timings["llm_first_token_ms"] = int((first_token_time - llm_start) * 1000)
-            if first_chunk_time:
-                timings["tts_first_chunk_ms"] = int((first_chunk_time - llm_start) * 1000)
+                    chunk_index += 1
+
+            stages = [
+                asyncio.create_task(produce_sentences()),
+                asyncio.create_task(consume_sentences()),
+                asyncio.create_task(emit_audio()),
+            ]
+            try:
+                await asyncio.gather(*stages)
+            finally:
+                # If one stage fails (e.g. a callback on a closed socket) or this task is
+                # cancelled, the others would block forever on the bounded queues
+                unfinished = [stage for stage in stages if not stage.done()]
+                for stage in unfinished:
+                    stage.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+                # TTS jobs nobody will emit now; ones not yet started never run
+                while not synth_queue.empty():
+                    job = synth_queue.get_nowait()
+                    if job is not None:
+                        job.cancel()
+
+            total_time = time.perf_counter_ns() - llm_start
+            timings["llm_ms"] = total_time // 1_000_000
+            if first_token_time is not None:
+                timings["llm_first_token_ms"] = (first_token_time - llm_start) // 1_000_000
+            if first_chunk_time is not None:
+                timings["tts_first_chunk_ms"] = (first_chunk_time - llm_start) // 1_000_000
             timings["tts_chunks"] = chunk_index
             logger.info(
                 "Stream: %d chars, %d chunks, first_audio=%dms, total=%dms",
@@ -525,10 +740,7 @@ class PipelineOrchestrator:
         self._append_history("user", transcript)
         self._append_history("assistant", full_response)
 
-        try:
-            rag_service.store_conversation(transcript, full_response, session_id=self.session_id)
-        except Exception as e:
-            logger.warning("Failed to store conversation memory: %s", e)
+        self._store_conversation_later(transcript, full_response)
 
         return {
             "transcript": transcript,
@@ -548,39 +760,36 @@ class PipelineOrchestrator:
         timings = {}
 
         # Check for direct page read (bypass LLM)
-        t0 = time.time()
-        direct = self._try_direct_page_read(message)
+        t0 = time.perf_counter_ns()
+        direct = await self._direct_page_read(message)
         if direct:
             response_text = direct["text"]
             sources = direct["sources"]
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
             timings["llm_ms"] = 0
             logger.info("Direct page read (text): %d chars", len(response_text))
         else:
             # RAG retrieval
-            context, sources = self._build_context(message)
-            timings["rag_ms"] = int((time.time() - t0) * 1000)
+            chunks, sources = await self._build_context(message)
+            timings["rag_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
 
             # LLM generation
-            t0 = time.time()
+            t0 = time.perf_counter_ns()
             response_text = await llm_service.generate(
                 user_message=message,
-                context=context,
+                chunks=chunks,
                 conversation_history=self._get_history(),
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
-            timings["llm_ms"] = int((time.time() - t0) * 1000)
+            timings["llm_ms"] = (time.perf_counter_ns() - t0) // 1_000_000
 
         # Update history
         self._append_history("user", message)
         self._append_history("assistant", response_text)
 
-        try:
-            rag_service.store_conversation(message, response_text, session_id=self.session_id)
-        except Exception as e:
-            logger.warning("Failed to store conversation memory: %s", e)
+        self._store_conversation_later(message, response_text)
 
         return {
             "response": response_text,
@@ -597,18 +806,18 @@ class PipelineOrchestrator:
     ):
         """Streaming text pipeline: text → RAG → LLM (stream) → tokens."""
         # Check for direct page read (bypass LLM)
-        direct = self._try_direct_page_read(message)
+        direct = await self._direct_page_read(message)
         if direct:
             full_response = direct["text"]
             logger.info("Direct page read (text_stream): %d chars", len(full_response))
             yield full_response
         else:
-            context, sources = self._build_context(message)
+            chunks, sources = await self._build_context(message)
 
             full_response = ""
             async for token in llm_service.generate_stream(
                 user_message=message,
-                context=context,
+                chunks=chunks,
                 conversation_history=self._get_history(),
                 model=model,
                 temperature=temperature,
@@ -621,24 +830,41 @@ class PipelineOrchestrator:
         self._append_history("user", message)
         self._append_history("assistant", full_response)
 
-        try:
-            rag_service.store_conversation(message, full_response, session_id=self.session_id)
-        except Exception as e:
-            logger.warning("Failed to store conversation memory: %s", e)
+        self._store_conversation_later(message, full_response)
 
 
 # --- Session-keyed orchestrator factory ---
 
-_orchestrators: dict[str, PipelineOrchestrator] = {}
+# Orchestrators keep no state that isn't in session_manager, so the least
+# recently used ones can be dropped and recreated on demand
+MAX_ORCHESTRATORS = 1000
+
+_orchestrators: OrderedDict[str, PipelineOrchestrator] = OrderedDict()
 
 
 def get_orchestrator(session_id: str) -> PipelineOrchestrator:
     """Get or create an orchestrator for a given session."""
-    if session_id not in _orchestrators:
-        _orchestrators[session_id] = PipelineOrchestrator(session_id)
-    return _orchestrators[session_id]
+    orch = _orchestrators.get(session_id)
+    if orch is not None:
+        _orchestrators.move_to_end(session_id)
+        return orch
+    # setdefault keeps whichever orchestrator got there first, so a concurrent
+    # caller can never replace one that already has work in flight
+    orch = _orchestrators.setdefault(session_id, PipelineOrchestrator(session_id))
+    if len(_orchestrators) > MAX_ORCHESTRATORS:
+        _orchestrators.popitem(last=False)
+    return orch
 
 
 def remove_orchestrator(session_id: str):
     """Remove an orchestrator when a session is deleted."""
     _orchestrators.pop(session_id, None)
+
+
+def invalidate_docs_cache(session_id: str | None = None):
+    """Drop cached document lists for one session, or for all sessions if None."""
+    if session_id is None:
+        for orch in _orchestrators.values():
+            orch.invalidate_docs_cache()
+    elif session_id in _orchestrators:
+        _orchestrators[session_id].invalidate_docs_cache()
@@ -0,0 +1,59 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+from config import PDF_EXTRACT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Spawning workers costs a few hundred ms, so only large PDFs are split, and
+# each worker gets at least PDF_MIN_PAGES_PER_WORKER pages
+PDF_PARALLEL_MIN_PAGES = 64
+PDF_MIN_PAGES_PER_WORKER = 32
+
+
+def _open(source: str | bytes) -> pymupdf.Document:
+    if isinstance(source, bytes):
+        return pymupdf.open(stream=source, filetype="pdf")
+    return pymupdf.open(source)
+
+
+def _extract_span(source: str | bytes, start: int, stop: int) -> list[tuple[int, str]]:
+    """Extract pages [start, stop) as (1-indexed page_number, page_text), skipping blank pages.
+
+    Module-level so worker processes can run it; each opens its own document,
+    since pymupdf documents can't be shared across processes.
+    """
+    doc = _open(source)
+    try:
+        pages = []
+        for i in range(start, stop):
+            text = doc[i].get_text()
+            if text.strip():
+                pages.append((i + 1, text))
+        return pages
+    finally:
+        doc.close()
+
+
+def extract_pages(source: str | bytes) -> list[tuple[int, str]]:
+    """Extract text from a PDF path or bytes, returning (1-indexed page_number, page_text) tuples.
+
+    Large PDFs are split into contiguous page spans extracted in parallel processes.
+    """
+    doc = _open(source)
+    page_count = doc.page_count
+    doc.close()
+
+    workers = min(PDF_EXTRACT_WORKERS, page_count // PDF_MIN_PAGES_PER_WORKER)
+    if page_count < PDF_PARALLEL_MIN_PAGES or workers < 2:
+        return _extract_span(source, 0, page_count)
+
+    span = -(-page_count // workers)  # ceil division
+    bounds = [(start, min(start + span, page_count)) for start in range(0, page_count, span)]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(bounds), mp_context=ctx) as pool:
+        futures = [pool.submit(_extract_span, source, start, stop) for start, stop in bounds]
+        pages = [page for future in futures for page in future.result()]
+    logger.info("Extracted %d pages with %d processes", page_count, len(bounds))
+    return pages
@@ -1,11 +1,21 @@
 import logging
+import re
+import threading
 import uuid
+from functools import lru_cache
 from pathlib import Path
 import chromadb
+import numpy as np
 from sentence_transformers import SentenceTransformer
+from pipeline.embed_cache import embedding_cache, text_hash
+from pipeline.onnx_embedder import OnnxEmbedder
 from config import (
+    CHROMA_HOST,
     CHROMA_PERSIST_DIR,
+    CHROMA_PORT,
+    EMBEDDING_BACKEND,
     EMBEDDING_MODEL,
+    EMBEDDING_ONNX_DIR,
     RAG_CHUNK_SIZE,
     RAG_CHUNK_OVERLAP,
     RAG_TOP_K,
@@ -15,43 +25,198 @@ logger = logging.getLogger(__name__)
 
 DOCUMENTS_COLLECTION = "documents"
 CONVERSATIONS_COLLECTION = "conversations"
-PAGES_COLLECTION = "pages"
+PAGES_COLLECTION = "pages"  # pages uploaded without a session
+# Session pages live in their own collection, "pages_<hash of session id>", so a
+# session's queries only search its own HNSW index however large the library grows
+PAGE_SHARD_RE = re.compile(r"pages_[0-9a-f]{16}")
+
+QUERY_EMBED_CACHE_SIZE = 512
+ENCODE_BATCH_SIZE = 64
+CHROMA_ADD_BATCH = 1000
+
+# Denser HNSW graph for the document/page indexes: better recall at top-k for a
+# small build-time cost. Changing these triggers a one-time rebuild in load().
+DOCUMENT_INDEX_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 64,
+}
+
+
+def _normalize_query(text: str) -> str:
+    """Case/whitespace-fold a query; the default MiniLM tokenizer is uncased anyway."""
+    return " ".join(text.lower().split())
 
 
 class RAGService:
     def __init__(self):
-        self._embedder: SentenceTransformer | None = None
+        self._embedder: SentenceTransformer | OnnxEmbedder | None = None
+        # Embedding-cache key; differs per backend since INT8 vectors aren't bit-identical
+        self._model_key = EMBEDDING_MODEL
         self._chroma: chromadb.ClientAPI | None = None
         self._doc_collection = None
         self._conv_collection = None
         self._pages_collection = None
+        # session_id hash -> pages collection; see PAGE_SHARD_RE
+        self._page_shards: dict[str, chromadb.Collection] = {}
+        self._shard_lock = threading.Lock()
+        # doc_id -> document summary, built from chunk metadata so listing never scans Chroma
+        self._doc_index: dict[str, dict] = {}
+        # Repeated voice queries ("next", "continue", ...) skip the embedder entirely
+        self._embed_query = lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)(self._embed_query_uncached)
 
     def load(self):
+        self.load_embedder()
+
+        if CHROMA_HOST:
+            # A separate server process does index work on its own threads, outside our GIL
+            logger.info("Connecting to ChromaDB server at %s:%d", CHROMA_HOST, CHROMA_PORT)
+            self._chroma = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        else:
+            logger.info("Initializing ChromaDB at %s", CHROMA_PERSIST_DIR)
+            Path(CHROMA_PERSIST_DIR).mkdir(parents=True, exist_ok=True)
+            self._chroma = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+        self._doc_collection = self._open_collection(DOCUMENTS_COLLECTION, DOCUMENT_INDEX_METADATA)
+        # Conversation memory stays small and is queried with k=2; defaults are fine
+        self._conv_collection = self._open_collection(CONVERSATIONS_COLLECTION, {"hnsw:space": "cosine"})
+        self._pages_collection = self._open_collection(PAGES_COLLECTION, DOCUMENT_INDEX_METADATA)
+        self._page_shards = {}
+        for collection in self._chroma.list_collections():
+            name = collection if isinstance(collection, str) else collection.name  # names only in chromadb 0.6
+            if PAGE_SHARD_RE.fullmatch(name):
+                self._page_shards[name] = self._open_collection(name, DOCUMENT_INDEX_METADATA)
+        self._shard_session_pages()
+        self._doc_index = self._summarize_chunks(self._doc_collection.get(include=["metadatas"])["metadatas"])
+        logger.info("ChromaDB initialized: docs=%d, convs=%d, pages=%d (%d session shards)",
+                     self._doc_collection.count(), self._conv_collection.count(),
+                     sum(c.count() for c in self._page_collections()), len(self._page_shards))
+
+    def _open_collection(self, name: str, metadata: dict):
+        """Get or create a collection, rebuilding it if its HNSW settings differ.
+
+        HNSW parameters are fixed when a collection is created, so collections
+        from older versions are copied into a new one with the current settings.
+        """
+        staging_name = f"{name}_migrating"
+        try:
+            collection = self._chroma.get_collection(name=name)
+        except Exception:  # not found (error type differs across chromadb versions)
+            try:
+                collection = self._chroma.get_collection(name=staging_name)
+            except Exception:
+                return self._chroma.create_collection(name=name, metadata=metadata)
+            # A rebuild stopped between dropping the original and renaming the copy,
+            # which is only dropped once complete, so the copy holds every row
+            logger.warning("Recovering collection %s from an interrupted rebuild", name)
+            collection.modify(name=name)
+
+        current = collection.metadata or {}
+        if all(current.get(key) == value for key, value in metadata.items()):
+            return collection
+
+        logger.info("Rebuilding collection %s with index settings %s (one-time migration)", name, metadata)
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        try:
+            self._chroma.delete_collection(name=staging_name)
+        except Exception:
+            pass
+        staging = self._chroma.create_collection(name=staging_name, metadata=metadata)
+        for i in range(0, len(data["ids"]), CHROMA_ADD_BATCH):
+            staging.add(
+                ids=data["ids"][i:i + CHROMA_ADD_BATCH],
+                embeddings=data["embeddings"][i:i + CHROMA_ADD_BATCH],
+                documents=data["documents"][i:i + CHROMA_ADD_BATCH],
+                metadatas=data["metadatas"][i:i + CHROMA_ADD_BATCH],
+            )
+        # Only drop the original once the copy is complete
+        self._chroma.delete_collection(name=name)
+        staging.modify(name=name)
+        return staging
+
+    def _pages_for(self, session_id: str | None, create: bool = False):
+        """The pages collection for a session; None if its shard doesn't exist and create is False."""
+        if not session_id:
+            return self.pages_collection
+        name = f"pages_{text_hash(session_id)[:16]}"
+        shard = self._page_shards.get(name)
+        if shard is None and create:
+            with self._shard_lock:
+                shard = self._page_shards.get(name)
+                if shard is None:
+                    shard = self._open_collection(name, DOCUMENT_INDEX_METADATA)
+                    self._page_shards[name] = shard
+        return shard
+
+    def _page_collections(self) -> list:
+        return [self.pages_collection, *self._page_shards.values()]
+
+    def _shard_session_pages(self):
+        """Move session pages stored in the shared pages collection by older versions into their shards."""
+        legacy = self.pages_collection
+        if legacy.count() == 0:
+            return
+        # Only rows that still need moving are fetched, so once migrated (the shared
+        # collection then holds sessionless pages only) this is one cheap filtered get
+        moved = 0
+        while True:
+            data = legacy.get(
+                where={"session_id": {"$ne": ""}},
+                limit=CHROMA_ADD_BATCH,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            if not data["ids"]:
+                break
+            by_session: dict[str, list[int]] = {}
+            keyless: list[int] = []
+            for i, meta in enumerate(data["metadatas"]):
+                if not meta or meta.get("session_id") is None:
+                    keyless.append(i)
+                else:
+                    by_session.setdefault(meta["session_id"], []).append(i)
+            if keyless:
+                # $ne also matches rows without the key (very old entries); they're sessionless,
+                # so record that, which keeps them out of this query from now on
+                legacy.update(
+                    ids=[data["ids"][j] for j in keyless],
+                    metadatas=[{**(data["metadatas"][j] or {}), "session_id": ""} for j in keyless],
+                )
+            for session_id, rows in by_session.items():
+                # upsert, so a batch copied before an interrupted delete is simply rewritten
+                self._pages_for(session_id, create=True).upsert(
+                    ids=[data["ids"][j] for j in rows],
+                    embeddings=np.asarray([data["embeddings"][j] for j in rows], dtype=np.float32),
+                    documents=[data["documents"][j] for j in rows],
+                    metadatas=[data["metadatas"][j] for j in rows],
+                )
+            # Only drop the originals once the batch is copied
+            moved_ids = [data["ids"][j] for rows in by_session.values() for j in rows]
+            if moved_ids:
+                legacy.delete(ids=moved_ids)
+            moved += len(moved_ids)
+        if moved:
+            logger.info("Moved %d session pages into per-session collections (one-time migration)", moved)
+
+    def load_embedder(self):
+        # Memoized query vectors belong to the previous model
+        self._embed_query.cache_clear()
+        if EMBEDDING_BACKEND == "onnx":
+            try:
+                logger.info("Loading ONNX INT8 embedding model: %s", EMBEDDING_MODEL)
+                self._embedder = OnnxEmbedder(EMBEDDING_MODEL, EMBEDDING_ONNX_DIR)
+                self._model_key = f"{EMBEDDING_MODEL}:onnx-int8"
+                logger.info("ONNX embedding model loaded")
+                return
+            except Exception:
+                logger.exception("Failed to load ONNX embedder, falling back to sentence-transformers")
+
         logger.info("Loading embedding model: %s", EMBEDDING_MODEL)
         self._embedder = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        self._model_key = EMBEDDING_MODEL
         logger.info("Embedding model loaded")
 
-        logger.info("Initializing ChromaDB at %s", CHROMA_PERSIST_DIR)
-        Path(CHROMA_PERSIST_DIR).mkdir(parents=True, exist_ok=True)
-        self._chroma = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
-        self._doc_collection = self._chroma.get_or_create_collection(
-            name=DOCUMENTS_COLLECTION,
-            metadata={"hnsw:space": "cosine"},
-        )
-        self._conv_collection = self._chroma.get_or_create_collection(
-            name=CONVERSATIONS_COLLECTION,
-            metadata={"hnsw:space": "cosine"},
-        )
-        self._pages_collection = self._chroma.get_or_create_collection(
-            name=PAGES_COLLECTION,
-            metadata={"hnsw:space": "cosine"},
-        )
-        logger.info("ChromaDB initialized: docs=%d, convs=%d, pages=%d",
-                     self._doc_collection.count(), self._conv_collection.count(),
-                     self._pages_collection.count())
-
     @property
-    def embedder(self) -> SentenceTransformer:
+    def embedder(self) -> SentenceTransformer | OnnxEmbedder:
         if self._embedder is None:
             raise RuntimeError("RAG service not loaded. Call load() first.")
         return self._embedder
@@ -74,16 +239,113 @@ class RAGService:
             raise RuntimeError("RAG service not loaded. Call load() first.")
         return self._pages_collection
 
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text as a unit-norm float32 vector (memoized, read-only)."""
+        return self._embed_query(_normalize_query(text), self._model_key)
+
+    def _embed_query_uncached(self, text: str, model: str) -> np.ndarray:
+        # model is part of the cache key only; it always names the loaded embedder
+        vec = self.embedder.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0]
+        vec = np.ascontiguousarray(vec, dtype=np.float32)
+        vec.flags.writeable = False  # shared by every caller that hits the memo
+        return vec
+
+    def _encode_cached(self, texts: list[str]) -> np.ndarray:
+        """Embed texts, reusing vectors from the on-disk cache and embedding only misses.
+
+        Duplicate texts within one call are embedded once.
+        """
+        hashes = [text_hash(t) for t in texts]
+        vectors = embedding_cache.get_many(hashes, self._model_key)
+        misses = {h: t for h, t in zip(hashes, texts) if h not in vectors}
+        if misses:
+            embedded = self._encode_sorted(list(misses.values()))
+            fresh = dict(zip(misses.keys(), embedded))
+            embedding_cache.put_many(fresh, self._model_key)
+            vectors.update(fresh)
+        if not hashes:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in hashes]).astype(np.float32, copy=False)
+
+    def _encode_sorted(self, texts: list[str]) -> np.ndarray:
+        """Encode texts in length order so each batch pads to similar lengths; rows come back in input order."""
+        if len(texts) < 2:
+            return self.embedder.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        embedded = self.embedder.encode(
+            [texts[i] for i in order],
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return embedded[inverse]
+
     # --- Document ingestion ---
+    #
+    # Ingestion is split into a CPU-heavy prepare step (parse, chunk, embed) that
+    # only needs the embedder, and a store step that writes to Chroma. The prepare
+    # step can therefore run in a worker process (see prepare_upload) while Chroma
+    # stays owned by the main process.
 
     def ingest_text(self, text: str, doc_id: str, filename: str, source_type: str = "text", session_id: str = "") -> int:
         """Chunk text and store embeddings. Returns number of chunks."""
+        prepared = self.prepare_text(text, doc_id, filename, source_type, session_id)
+        return self.store_prepared(prepared)[1]
+
+    def ingest_pages(self, pages: list[tuple[int, str]], doc_id: str, filename: str, source_type: str = "pdf", session_id: str = "") -> int:
+        """Ingest per-page text: store full pages and chunked embeddings with page metadata."""
+        prepared = self.prepare_pages(pages, doc_id, filename, source_type, session_id)
+        return self.store_prepared(prepared)[1]
+
+    def ingest_file(self, file_path: str, filename: str, session_id: str = "") -> tuple[str, int]:
+        """Parse and ingest a file. Returns (doc_id, chunk_count)."""
+        return self.store_prepared(self.prepare_file(file_path, filename, session_id))
+
+    def ingest_bytes(self, data: bytes, filename: str, session_id: str = "") -> tuple[str, int]:
+        """Parse and ingest file bytes. Returns (doc_id, chunk_count)."""
+        return self.store_prepared(self.prepare_bytes(data, filename, session_id))
+
+    def prepare_file(self, file_path: str, filename: str, session_id: str = "") -> dict:
+        """Parse, chunk and embed a file on disk without touching Chroma."""
+        doc_id = str(uuid.uuid4())
+        ext = Path(filename).suffix.lower()
+
+        if ext == ".pdf":
+            pages = self._parse_pdf(file_path)
+            return self.prepare_pages(pages, doc_id, filename, source_type="pdf", session_id=session_id)
+        elif ext in (".txt", ".md", ".text"):
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            return self.prepare_text(text, doc_id, filename, source_type=ext.lstrip("."), session_id=session_id)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+
+    def prepare_bytes(self, data: bytes, filename: str, session_id: str = "") -> dict:
+        """Parse, chunk and embed file bytes without touching Chroma."""
+        doc_id = str(uuid.uuid4())
+        ext = Path(filename).suffix.lower()
+
+        if ext == ".pdf":
+            pages = self._parse_pdf_bytes(data)
+            return self.prepare_pages(pages, doc_id, filename, source_type="pdf", session_id=session_id)
+        elif ext in (".txt", ".md", ".text"):
+            text = data.decode("utf-8", errors="replace")
+            return self.prepare_text(text, doc_id, filename, source_type=ext.lstrip("."), session_id=session_id)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+
+    def prepare_text(self, text: str, doc_id: str, filename: str, source_type: str = "text", session_id: str = "") -> dict:
+        """Chunk and embed plain text. Returns a prepared document for store_prepared()."""
+        prepared = {"doc_id": doc_id, "filename": filename, "chunk_count": 0, "writes": []}
         chunks = self._chunk_text(text, RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP)
         if not chunks:
-            return 0
+            return prepared
 
-        embeddings = self.embedder.encode(chunks).tolist()
-        ids = [f"{doc_id}_chunk_{i}" for i in range(len(chunks))]
+        embeddings = self._encode_cached(chunks)
+        prefix = doc_id + "_chunk_"
+        ids = [prefix + str(i) for i in range(len(chunks))]
         metadatas = [
             {
                 "doc_id": doc_id,
@@ -96,118 +358,107 @@ class RAGService:
             for i in range(len(chunks))
         ]
 
-        self.doc_collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=chunks,
-            metadatas=metadatas,
-        )
-        logger.info("Ingested %d chunks for doc %s (%s)", len(chunks), doc_id, filename)
-        return len(chunks)
+        prepared["writes"].append((DOCUMENTS_COLLECTION, ids, embeddings, chunks, metadatas))
+        prepared["chunk_count"] = len(chunks)
+        return prepared
 
-    def ingest_pages(self, pages: list[tuple[int, str]], doc_id: str, filename: str, source_type: str = "pdf", session_id: str = "") -> int:
-        """Ingest per-page text: store full pages and chunked embeddings with page metadata."""
-        total_chunks = 0
+    def prepare_pages(self, pages: list[tuple[int, str]], doc_id: str, filename: str, source_type: str = "pdf", session_id: str = "") -> dict:
+        """Embed full pages and their chunks. Returns a prepared document for store_prepared()."""
+        # Collect every page and chunk first so each collection needs one encode call
+        page_ids, page_texts, page_metas = [], [], []
+        chunk_ids, chunk_texts, chunk_metas = [], [], []
 
         for page_num, page_text in pages:
             page_text = page_text.strip()
             if not page_text:
                 continue
 
-            # Store full page in pages collection
-            page_id = f"{doc_id}_page_{page_num}"
-            page_embedding = self.embedder.encode([page_text]).tolist()
-            self.pages_collection.add(
-                ids=[page_id],
-                embeddings=page_embedding,
-                documents=[page_text],
-                metadatas=[{
-                    "doc_id": doc_id,
-                    "filename": filename,
-                    "page_number": page_num,
-                    "source_type": source_type,
-                    "session_id": session_id,
-                }],
-            )
+            # Full page goes to the pages collection
+            page_ids.append(f"{doc_id}_page_{page_num}")
+            page_texts.append(page_text)
+            page_metas.append({
+                "doc_id": doc_id,
+                "filename": filename,
+                "page_number": page_num,
+                "source_type": source_type,
+                "session_id": session_id,
+            })
 
-            # Chunk the page text and store in doc collection
+            # Chunk the page text for the doc collection
             chunks = self._chunk_text(page_text, RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP)
-            if not chunks:
-                continue
-
-            embeddings = self.embedder.encode(chunks).tolist()
-            ids = [f"{doc_id}_page{page_num}_chunk_{i}" for i in range(len(chunks))]
-            metadatas = [
-                {
+            prefix = f"{doc_id}_page{page_num}_chunk_"
+            chunk_ids.extend([prefix + str(i) for i in range(len(chunks))])
+            for chunk in chunks:
+                chunk_metas.append({
                     "doc_id": doc_id,
                     "filename": filename,
-                    "chunk_index": total_chunks + i,
+                    "chunk_index": len(chunk_texts),
                     "page_number": page_num,
                     "source_type": source_type,
                     "session_id": session_id,
-                }
-                for i in range(len(chunks))
-            ]
-
-            self.doc_collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=metadatas,
-            )
-            total_chunks += len(chunks)
+                })
+                chunk_texts.append(chunk)
+
+        # One pass over pages + chunks: _encode_cached embeds each distinct text once, so
+        # a page that fits in a single chunk reuses the page vector for that chunk
+        embeddings = self._encode_cached(page_texts + chunk_texts)
+        writes = []
+        if page_texts:
+            writes.append((PAGES_COLLECTION, page_ids, embeddings[:len(page_texts)], page_texts, page_metas))
+        if chunk_texts:
+            writes.append((DOCUMENTS_COLLECTION, chunk_ids, embeddings[len(page_texts):], chunk_texts, chunk_metas))
 
-        logger.info("Ingested %d pages (%d chunks) for doc %s (%s)",
-                     len(pages), total_chunks, doc_id, filename)
-        return total_chunks
-
-    def ingest_file(self, file_path: str, filename: str, session_id: str = "") -> tuple[str, int]:
-        """Parse and ingest a file. Returns (doc_id, chunk_count)."""
-        doc_id = str(uuid.uuid4())
-        ext = Path(filename).suffix.lower()
-
-        if ext == ".pdf":
-            pages = self._parse_pdf(file_path)
-            chunk_count = self.ingest_pages(pages, doc_id, filename, source_type="pdf", session_id=session_id)
-        elif ext in (".txt", ".md", ".text"):
-            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-                text = f.read()
-            chunk_count = self.ingest_text(text, doc_id, filename, source_type=ext.lstrip("."), session_id=session_id)
-        else:
-            raise ValueError(f"Unsupported file type: {ext}")
-
-        return doc_id, chunk_count
-
-    def ingest_bytes(self, data: bytes, filename: str, session_id: str = "") -> tuple[str, int]:
-        """Parse and ingest file bytes. Returns (doc_id, chunk_count)."""
-        doc_id = str(uuid.uuid4())
-        ext = Path(filename).suffix.lower()
+        return {
+            "doc_id": doc_id,
+            "filename": filename,
+            "page_count": len(pages),
+            "chunk_count": len(chunk_texts),
+            "writes": writes,
+        }
 
-        if ext == ".pdf":
-            pages = self._parse_pdf_bytes(data)
-            chunk_count = self.ingest_pages(pages, doc_id, filename, source_type="pdf", session_id=session_id)
-        elif ext in (".txt", ".md", ".text"):
-            text = data.decode("utf-8", errors="replace")
-            chunk_count = self.ingest_text(text, doc_id, filename, source_type=ext.lstrip("."), session_id=session_id)
+    def store_prepared(self, prepared: dict) -> tuple[str, int]:
+        """Write a prepared document to Chroma. Returns (doc_id, chunk_count)."""
+        # One add per collection, split only to bound memory on very large documents
+        for name, ids, embeddings, documents, metadatas in prepared["writes"]:
+            if name == PAGES_COLLECTION:
+                collection = self._pages_for(metadatas[0].get("session_id"), create=True)
+            else:
+                collection = self.doc_collection
+            for i in range(0, len(ids), CHROMA_ADD_BATCH):
+                collection.add(
+                    ids=ids[i:i + CHROMA_ADD_BATCH],
+                    embeddings=embeddings[i:i + CHROMA_ADD_BATCH],
+                    documents=documents[i:i + CHROMA_ADD_BATCH],
+                    metadatas=metadatas[i:i + CHROMA_ADD_BATCH],
+                )
+
+        doc_id = prepared["doc_id"]
+        for name, _, _, _, metadatas in prepared["writes"]:
+            if name == DOCUMENTS_COLLECTION:
+                self._doc_index.update(self._summarize_chunks(metadatas))
+        if "page_count" in prepared:
+            logger.info("Ingested %d pages (%d chunks) for doc %s (%s)",
+                         prepared["page_count"], prepared["chunk_count"], doc_id, prepared["filename"])
         else:
-            raise ValueError(f"Unsupported file type: {ext}")
-
-        return doc_id, chunk_count
+            logger.info("Ingested %d chunks for doc %s (%s)",
+                         prepared["chunk_count"], doc_id, prepared["filename"])
+        return doc_id, prepared["chunk_count"]
 
     # --- Retrieval ---
 
     def retrieve(self, query: str, k: int | None = None, session_id: str | None = None) -> list[dict]:
         """Retrieve top-k relevant document chunks with metadata, optionally filtered by session."""
         k = k or RAG_TOP_K
-        if self.doc_collection.count() == 0:
+        n = self.doc_collection.count()
+        if n == 0:
             return []
 
-        query_embedding = self.embedder.encode([query]).tolist()
+        query_embedding = self.embed(query)[None, :]
         where_filter = {"session_id": session_id} if session_id else None
         try:
             results = self.doc_collection.query(
                 query_embeddings=query_embedding,
-                n_results=min(k, self.doc_collection.count()),
+                n_results=min(k, n),
                 include=["documents", "metadatas"],
                 where=where_filter,
             )
@@ -215,7 +466,7 @@ class RAGService:
             # Fallback: if filter fails (e.g. no session_id metadata on old entries)
             results = self.doc_collection.query(
                 query_embeddings=query_embedding,
-                n_results=min(k, self.doc_collection.count()),
+                n_results=min(k, n),
                 include=["documents", "metadatas"],
             )
 
@@ -235,31 +486,36 @@ class RAGService:
         return chunks
 
     def retrieve_pages(self, query: str, k: int = 3, session_id: str | None = None) -> list[dict]:
-        """Retrieve top-k relevant FULL PAGES (not chunks) with metadata."""
-        if self.pages_collection.count() == 0:
-            return []
+        """Retrieve top-k relevant FULL PAGES (not chunks) with metadata.
 
-        query_embedding = self.embedder.encode([query]).tolist()
-        where_filter = {"session_id": session_id} if session_id else None
-        try:
-            results = self.pages_collection.query(
-                query_embeddings=query_embedding,
-                n_results=min(k, self.pages_collection.count()),
-                include=["documents", "metadatas"],
-                where=where_filter,
-            )
-        except Exception:
-            results = self.pages_collection.query(
+        A session searches only its own shard; without one, every pages
+        collection is searched and the hits merged by distance.
+        """
+        if session_id:
+            shard = self._pages_for(session_id)
+            collections = [shard] if shard is not None else []
+        else:
+            collections = self._page_collections()
+        query_embedding = None
+        hits = []
+        for collection in collections:
+            n = collection.count()
+            if n == 0:
+                continue
+            if query_embedding is None:
+                query_embedding = self.embed(query)[None, :]
+            results = collection.query(
                 query_embeddings=query_embedding,
-                n_results=min(k, self.pages_collection.count()),
-                include=["documents", "metadatas"],
+                n_results=min(k, n),
+                include=["documents", "metadatas", "distances"],
             )
+            if results["documents"] and results["documents"][0]:
+                hits.extend(zip(results["distances"][0], results["documents"][0], results["metadatas"][0]))
 
-        if not results["documents"] or not results["documents"][0]:
-            return []
-
+        if len(collections) > 1:
+            hits.sort(key=lambda hit: hit[0])
         pages = []
-        for doc, meta in zip(results["documents"][0], results["metadatas"][0]):
+        for _, doc, meta in hits[:k]:
             pages.append({
                 "text": doc,
                 "doc_id": meta.get("doc_id", ""),
@@ -271,22 +527,23 @@ class RAGService:
 
     def retrieve_conversations(self, query: str, k: int = 2, session_id: str | None = None) -> list[str]:
         """Retrieve relevant past conversation exchanges."""
-        if self.conv_collection.count() == 0:
+        n = self.conv_collection.count()
+        if n == 0:
             return []
 
-        query_embedding = self.embedder.encode([query]).tolist()
+        query_embedding = self.embed(query)[None, :]
         where_filter = {"session_id": session_id} if session_id else None
         try:
             results = self.conv_collection.query(
                 query_embeddings=query_embedding,
-                n_results=min(k, self.conv_collection.count()),
+                n_results=min(k, n),
                 where=where_filter,
             )
         except Exception:
             # If filter fails (e.g. no session_id metadata on old entries), query without filter
             results = self.conv_collection.query(
                 query_embeddings=query_embedding,
-                n_results=min(k, self.conv_collection.count()),
+                n_results=min(k, n),
             )
         return results["documents"][0] if results["documents"] else []
 
@@ -294,7 +551,7 @@ class RAGService:
         """Store a conversation exchange for future retrieval."""
         exchange = f"User: {user_text}\nAssistant: {assistant_text}"
         exchange_id = str(uuid.uuid4())
-        embedding = self.embedder.encode([exchange]).tolist()
+        embedding = self._encode_sorted([exchange]).astype(np.float32, copy=False)
         metadata = {"type": "conversation"}
         if session_id:
             metadata["session_id"] = session_id
@@ -310,8 +567,12 @@ class RAGService:
     def get_page(self, doc_id: str, page_number: int) -> dict | None:
         """Fetch a full page from the pages collection."""
         page_id = f"{doc_id}_page_{page_number}"
+        doc = self._doc_index.get(doc_id)
+        pages = self._pages_for(doc["session_id"] if doc else None)
+        if pages is None:
+            return None
         try:
-            result = self.pages_collection.get(
+            result = pages.get(
                 ids=[page_id],
                 include=["documents", "metadatas"],
             )
@@ -331,23 +592,18 @@ class RAGService:
 
     # --- Document management ---
 
-    def list_documents(self, session_id: str | None = None) -> list[dict]:
-        """List ingested documents, optionally filtered by session."""
-        if self.doc_collection.count() == 0:
-            return []
-
-        all_meta = self.doc_collection.get(include=["metadatas"])
+    @staticmethod
+    def _summarize_chunks(metadatas: list[dict]) -> dict[str, dict]:
+        """Aggregate chunk metadata into per-document summaries keyed by doc_id."""
         docs: dict[str, dict] = {}
-        for meta in all_meta["metadatas"]:
-            # Filter by session if requested
-            if session_id is not None and meta.get("session_id", "") != session_id:
-                continue
+        for meta in metadatas:
             did = meta["doc_id"]
             if did not in docs:
                 docs[did] = {
                     "doc_id": did,
                     "filename": meta["filename"],
                     "source_type": meta.get("source_type", ""),
+                    "session_id": meta.get("session_id", ""),
                     "chunks": 0,
                     "pages": set(),
                 }
@@ -355,9 +611,15 @@ class RAGService:
             pn = meta.get("page_number", -1)
             if pn >= 0:
                 docs[did]["pages"].add(pn)
+        return docs
 
+    def list_documents(self, session_id: str | None = None) -> list[dict]:
+        """List ingested documents, optionally filtered by session."""
         result = []
-        for d in docs.values():
+        # list() snapshots the values, so a concurrent ingest can't break the iteration
+        for d in list(self._doc_index.values()):
+            if session_id is not None and d["session_id"] != session_id:
+                continue
             result.append({
                 "doc_id": d["doc_id"],
                 "filename": d["filename"],
@@ -367,31 +629,34 @@ class RAGService:
             })
         return result
 
+    @staticmethod
+    def _ids_where(collection, key: str, value: str) -> list[str]:
+        """Ids of entries whose metadata[key] == value, filtered by Chroma rather than in Python."""
+        try:
+            return collection.get(where={key: value}, include=[])["ids"]
+        except Exception:
+            # Fallback: scan metadata if the where filter is rejected
+            all_data = collection.get(include=["metadatas"])
+            return [
+                id_ for id_, meta in zip(all_data["ids"], all_data["metadatas"])
+                if meta.get(key) == value
+            ]
+
     def delete_document(self, doc_id: str) -> bool:
         """Remove all chunks and pages for a document."""
-        # Delete from doc collection
-        all_data = self.doc_collection.get(include=["metadatas"])
-        doc_ids_to_delete = [
-            id_ for id_, meta in zip(all_data["ids"], all_data["metadatas"])
-            if meta.get("doc_id") == doc_id
-        ]
-
-        # Delete from pages collection
-        page_ids_to_delete = []
-        if self.pages_collection.count() > 0:
-            all_pages = self.pages_collection.get(include=["metadatas"])
-            page_ids_to_delete = [
-                id_ for id_, meta in zip(all_pages["ids"], all_pages["metadatas"])
-                if meta.get("doc_id") == doc_id
-            ]
+        doc = self._doc_index.get(doc_id)
+        pages = self._pages_for(doc["session_id"] if doc else None)
+        doc_ids_to_delete = self._ids_where(self.doc_collection, "doc_id", doc_id)
+        page_ids_to_delete = self._ids_where(pages, "doc_id", doc_id) if pages is not None else []
 
         if not doc_ids_to_delete and not page_ids_to_delete:
             return False
 
+        self._doc_index.pop(doc_id, None)
         if doc_ids_to_delete:
             self.doc_collection.delete(ids=doc_ids_to_delete)
         if page_ids_to_delete:
-            self.pages_collection.delete(ids=page_ids_to_delete)
+            pages.delete(ids=page_ids_to_delete)
 
         logger.info("Deleted %d chunks + %d pages for doc %s",
                      len(doc_ids_to_delete), len(page_ids_to_delete), doc_id)
@@ -399,13 +664,7 @@ class RAGService:
 
     def delete_session_conversations(self, session_id: str):
         """Delete all conversation entries for a session."""
-        if self.conv_collection.count() == 0:
-            return
-        all_data = self.conv_collection.get(include=["metadatas"])
-        ids_to_delete = [
-            id_ for id_, meta in zip(all_data["ids"], all_data["metadatas"])
-            if meta.get("session_id") == session_id
-        ]
+        ids_to_delete = self._ids_where(self.conv_collection, "session_id", session_id)
         if ids_to_delete:
             self.conv_collection.delete(ids=ids_to_delete)
             logger.info("Deleted %d conversation entries for session %s", len(ids_to_delete), session_id)
@@ -418,41 +677,34 @@ class RAGService:
         text = text.strip()
         if not text:
             return []
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            start += chunk_size - overlap
-        return chunks
+        # strip() only walks inward from each end, so per-chunk stripping is cheap;
+        # the boundaries are plain arithmetic
+        chunks = (text[start:start + chunk_size].strip() for start in range(0, len(text), chunk_size - overlap))
+        return [chunk for chunk in chunks if chunk]
 
     @staticmethod
     def _parse_pdf(file_path: str) -> list[tuple[int, str]]:
         """Extract text from a PDF file, returning (1-indexed page_number, page_text) tuples."""
-        import pymupdf
-        doc = pymupdf.open(file_path)
-        pages = []
-        for i, page in enumerate(doc):
-            text = page.get_text()
-            if text.strip():
-                pages.append((i + 1, text))
-        doc.close()
-        return pages
+        from pipeline.pdf import extract_pages
+        return extract_pages(file_path)
 
     @staticmethod
     def _parse_pdf_bytes(data: bytes) -> list[tuple[int, str]]:
         """Extract text from PDF bytes, returning (1-indexed page_number, page_text) tuples."""
-        import pymupdf
-        doc = pymupdf.open(stream=data, filetype="pdf")
-        pages = []
-        for i, page in enumerate(doc):
-            text = page.get_text()
-            if text.strip():
-                pages.append((i + 1, text))
-        doc.close()
-        return pages
+        from pipeline.pdf import extract_pages
+        return extract_pages(data)
 
 
 rag_service = RAGService()
+
+
+# --- Ingestion worker process entry points ---
+
+def init_ingest_worker():
+    """ProcessPoolExecutor initializer: load the embedder once per worker."""
+    rag_service.load_embedder()
+
+
+def prepare_upload(file_path: str, filename: str, session_id: str = "") -> dict:
+    """Worker task: parse, chunk and embed a spooled upload using the worker's embedder."""
+    return rag_service.prepare_file(file_path, filename, session_id=session_id)
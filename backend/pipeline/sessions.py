@@ -1,13 +1,23 @@
-import json
 import logging
+import os
+import threading
 import time
 import uuid
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from pathlib import Path
+import orjson
 from config import SESSIONS_DIR
 
 logger = logging.getLogger(__name__)
 
+# Dirty sessions are written to disk at most this often, off the request path
+SESSION_FLUSH_INTERVAL = 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) used for history budgeting."""
+    return len(text) // 4 + 1
+
 
 @dataclass
 class SessionData:
@@ -22,13 +32,23 @@ class SessionData:
 class SessionManager:
     def __init__(self):
         self._sessions: dict[str, SessionData] = {}
+        # Sorted session summaries for list_all(), rebuilt lazily after any change
+        self._listing: list[dict] | None = None
         self._load_all()
 
+        # Write-behind: _persist only marks a session dirty; the writer thread saves it
+        self._dirty: set[str] = set()
+        self._dirty_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # serializes file writes against delete()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+
     def _load_all(self):
         """Scan sessions directory on startup and load all JSON files."""
         for path in SESSIONS_DIR.glob("*.json"):
             try:
-                data = json.loads(path.read_text())
+                data = orjson.loads(path.read_bytes())
                 session = SessionData(**data)
                 self._sessions[session.session_id] = session
             except Exception as e:
@@ -36,12 +56,41 @@ class SessionManager:
         logger.info("Loaded %d sessions from disk", len(self._sessions))
 
     def _persist(self, session_id: str):
-        """Write a single session to disk."""
-        session = self._sessions.get(session_id)
-        if not session:
-            return
-        path = SESSIONS_DIR / f"{session_id}.json"
-        path.write_text(json.dumps(asdict(session), indent=2))
+        """Mark a session for the writer thread to save."""
+        self._listing = None
+        with self._dirty_lock:
+            self._dirty.add(session_id)
+
+    def _write(self, session_id: str):
+        """Save one session via a temp file and atomic rename, so a crash never leaves a torn file."""
+        with self._write_lock:
+            session = self._sessions.get(session_id)
+            if not session:
+                return  # deleted since it was marked dirty
+            path = SESSIONS_DIR / f"{session_id}.json"
+            tmp = path.with_suffix(".json.tmp")
+            tmp.write_bytes(orjson.dumps(session))  # orjson serializes dataclasses natively
+            os.replace(tmp, path)
+
+    def flush(self):
+        """Write every dirty session now."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for session_id in dirty:
+            try:
+                self._write(session_id)
+            except Exception as e:
+                logger.warning("Failed to save session %s: %s", session_id, e)
+
+    def _write_loop(self):
+        while not self._stop.wait(SESSION_FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self):
+        """Stop the writer thread and save anything still pending."""
+        self._stop.set()
+        self._writer.join()
+        self.flush()
 
     def create(self, title: str = "New chat") -> SessionData:
         """Create a new session."""
@@ -67,30 +116,36 @@ class SessionManager:
 
     def list_all(self) -> list[dict]:
         """List all sessions sorted by updated_at descending."""
-        sessions = sorted(
-            self._sessions.values(),
-            key=lambda s: s.updated_at,
-            reverse=True,
-        )
-        return [
-            {
-                "session_id": s.session_id,
-                "title": s.title,
-                "created_at": s.created_at,
-                "updated_at": s.updated_at,
-                "message_count": len(s.conversation_history),
-            }
-            for s in sessions
-        ]
+        if self._listing is None:
+            sessions = sorted(
+                self._sessions.values(),
+                key=lambda s: s.updated_at,
+                reverse=True,
+            )
+            self._listing = [
+                {
+                    "session_id": s.session_id,
+                    "title": s.title,
+                    "created_at": s.created_at,
+                    "updated_at": s.updated_at,
+                    "message_count": len(s.conversation_history),
+                }
+                for s in sessions
+            ]
+        return list(self._listing)
 
     def delete(self, session_id: str) -> bool:
         """Delete a session from memory and disk."""
         if session_id not in self._sessions:
             return False
         del self._sessions[session_id]
+        self._listing = None
+        with self._dirty_lock:
+            self._dirty.discard(session_id)
         path = SESSIONS_DIR / f"{session_id}.json"
-        if path.exists():
-            path.unlink()
+        with self._write_lock:
+            if path.exists():
+                path.unlink()
         return True
 
     def update_title(self, session_id: str, title: str) -> bool:
@@ -107,7 +162,11 @@ class SessionManager:
         session = self._sessions.get(session_id)
         if not session:
             return
-        session.conversation_history.append({"role": role, "content": content})
+        session.conversation_history.append({
+            "role": role,
+            "content": content,
+            "tokens": estimate_tokens(content),
+        })
         session.updated_at = time.time()
 
         # Auto-title from first user message
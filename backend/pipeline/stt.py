@@ -1,13 +1,62 @@
 import io
 import logging
 import wave
+from collections.abc import Iterator
 import numpy as np
 from faster_whisper import WhisperModel
-from config import WHISPER_MODEL, WHISPER_DEVICE, WHISPER_COMPUTE_TYPE, AUDIO_SAMPLE_RATE
+from config import (
+    WHISPER_MODEL,
+    WHISPER_DEVICE,
+    WHISPER_COMPUTE_TYPE,
+    WHISPER_CPU_THREADS,
+    WHISPER_NUM_WORKERS,
+    AUDIO_SAMPLE_RATE,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _pcm_to_float32(frames: bytes, sample_width: int) -> np.ndarray:
+    """Scale integer PCM to [-1, 1) float32 in one ufunc pass, with no intermediate cast buffer."""
+    if sample_width == 4:
+        pcm, scale = np.frombuffer(frames, dtype=np.int32), np.float32(1.0 / 2147483648.0)
+    else:
+        pcm, scale = np.frombuffer(frames, dtype=np.int16), np.float32(1.0 / 32768.0)
+    out = np.empty(pcm.shape, dtype=np.float32)
+    np.multiply(pcm, scale, out=out, casting="unsafe")
+    return out
+
+
+def _riff_pcm(audio_bytes: bytes) -> tuple[memoryview, int] | None:
+    """Locate the PCM samples in a WAV by walking its chunk headers.
+
+    Returns (frames, sample_width) as a zero-copy view, or None if the header
+    isn't plain PCM, so the caller can fall back to the wave module.
+    """
+    if audio_bytes[:4] != b"RIFF" or audio_bytes[8:12] != b"WAVE":
+        return None
+    sample_width = None
+    pos, end = 12, len(audio_bytes)
+    while pos + 8 <= end:
+        chunk_id = audio_bytes[pos:pos + 4]
+        size = int.from_bytes(audio_bytes[pos + 4:pos + 8], "little")
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            fmt_tag = int.from_bytes(audio_bytes[body:body + 2], "little")
+            if fmt_tag not in (1, 0xFFFE):  # PCM / WAVE_FORMAT_EXTENSIBLE
+                return None
+            sample_width = int.from_bytes(audio_bytes[body + 14:body + 16], "little") // 8
+        elif chunk_id == b"data":
+            if sample_width not in (2, 4):
+                return None
+            # Streamed WAVs may carry a placeholder size, so clamp to what's actually there
+            stop = min(body + size, end)
+            stop -= (stop - body) % sample_width
+            return memoryview(audio_bytes)[body:stop], sample_width
+        pos = body + size + (size & 1)  # chunks are word-aligned
+    return None
+
+
 class STTService:
     def __init__(self):
         self._model: WhisperModel | None = None
@@ -21,6 +70,8 @@ class STTService:
             WHISPER_MODEL,
             device=WHISPER_DEVICE,
             compute_type=WHISPER_COMPUTE_TYPE,
+            cpu_threads=WHISPER_CPU_THREADS,
+            num_workers=WHISPER_NUM_WORKERS,
         )
         logger.info("Whisper model loaded")
 
@@ -32,33 +83,46 @@ class STTService:
 
     def transcribe_bytes(self, audio_bytes: bytes) -> tuple[str, float]:
         """Transcribe WAV/PCM audio bytes. Returns (text, duration_seconds)."""
-        audio_array = self._bytes_to_array(audio_bytes)
-        segments, info = self.model.transcribe(
-            audio_array,
+        audio = self._bytes_to_array(audio_bytes)
+        text = " ".join(seg_text for seg_text, _start, _end in self.transcribe_bytes_stream(audio))
+        # faster-whisper reports the same: input samples over its 16 kHz rate
+        return text, len(audio) / AUDIO_SAMPLE_RATE
+
+    def transcribe_bytes_stream(self, audio_bytes: bytes | np.ndarray) -> Iterator[tuple[str, float, float]]:
+        """Yield (text, start_seconds, end_seconds) per segment as soon as each is decoded.
+
+        Also accepts audio already decoded by _bytes_to_array (16 kHz float32).
+        """
+        audio = audio_bytes if isinstance(audio_bytes, np.ndarray) else self._bytes_to_array(audio_bytes)
+        # Decoding is lazy: each segment is transcribed as the generator is advanced
+        segments, _info = self.model.transcribe(
+            audio,
             beam_size=1,
             language="en",
             vad_filter=True,
+            vad_parameters={"min_silence_duration_ms": 500},
+            # Utterances are short and independent; conditioning only risks repetition loops
+            condition_on_previous_text=False,
         )
-        text = " ".join(seg.text.strip() for seg in segments)
-        return text, info.duration
+        for seg in segments:
+            yield seg.text.strip(), seg.start, seg.end
 
     def _bytes_to_array(self, audio_bytes: bytes) -> np.ndarray:
         """Convert WAV or raw PCM bytes to float32 numpy array."""
+        if audio_bytes[:4] != b"RIFF":
+            # Assume raw PCM 16-bit
+            return _pcm_to_float32(audio_bytes, 2)
+        pcm = _riff_pcm(audio_bytes)
+        if pcm is not None:
+            return _pcm_to_float32(*pcm)
+        # Unusual header: let the wave module sort it out
         try:
             with wave.open(io.BytesIO(audio_bytes), "rb") as wf:
                 frames = wf.readframes(wf.getnframes())
-                sample_width = wf.getsampwidth()
-                if sample_width == 2:
-                    audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
-                elif sample_width == 4:
-                    audio = np.frombuffer(frames, dtype=np.int32).astype(np.float32) / 2147483648.0
-                else:
-                    audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
-                return audio
+                return _pcm_to_float32(frames, wf.getsampwidth())
         except wave.Error:
             # Assume raw PCM 16-bit
-            audio = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
-            return audio
+            return _pcm_to_float32(audio_bytes, 2)
 
 
 stt_service = STTService()
@@ -1,47 +1,177 @@
-import io
 import logging
 import re
-import wave
+import struct
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-from config import TTS_VOICE, TTS_LANG_CODE
+from config import TTS_VOICE, TTS_LANG_CODE, TTS_FLOAT_WAV, TTS_SYNTH_WORKERS
 
 logger = logging.getLogger(__name__)
 
-# Patterns for text cleaning before TTS
+# Kokoro's torch kernels release the GIL, so long text is split into sentence batches
+# of about TTS_BATCH_CHARS that synthesize on a thread pool. Shorter text goes in one call,
+# where splitting would only cost prosody at the joins
+TTS_PARALLEL_MIN_CHARS = 400
+TTS_BATCH_CHARS = 200
+
+_synth_executor = (
+    ThreadPoolExecutor(max_workers=TTS_SYNTH_WORKERS, thread_name_prefix="tts-batch")
+    if TTS_SYNTH_WORKERS > 1 else None
+)
+
+# Patterns for text cleaning before TTS, applied in this order
 _THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+# Emotion tags that Chatterbox supported but Kokoro does not
+_EMOTION_TAG_RE = re.compile(
+    r"\[(?:laugh|chuckle|cough|sigh|gasp|sniff|groan|shush|clear throat|pause)\]",
+    re.IGNORECASE,
+)
+_URL_RE = re.compile(r"https?://\S+")
+# Emoji codepoint ranges (inclusive)
+_EMOJI_RANGES = (
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F1E0, 0x1F1FF),  # flags
+    (0x2702, 0x27B0),    # dingbats
+    (0x1F900, 0x1F9FF),  # supplemental symbols
+    (0x1FA00, 0x1FA6F),  # chess symbols
+    (0x1FA70, 0x1FAFF),  # symbols extended-A
+    (0x2600, 0x26FF),    # misc symbols
+    (0xFE00, 0xFE0F),    # variation selectors
+    (0x200D, 0x200D),    # zero width joiner
+)
+_EMOJI_RE = re.compile("[" + "".join(f"{chr(lo)}-{chr(hi)}" for lo, hi in _EMOJI_RANGES) + "]+")
+# The same ranges as a codepoint lookup table (every range is below 0x20000). Past a few
+# hundred characters one vectorized lookup beats sre testing the class at every position
+_EMOJI_MASK = np.zeros(0x20000, dtype=np.bool_)
+for _lo, _hi in _EMOJI_RANGES:
+    _EMOJI_MASK[_lo:_hi + 1] = True
+del _lo, _hi
+_EMOJI_MASK_MIN_CHARS = 512
+# UTF-8 lead bytes of every emoji range (a loose superset: U+1F000-1FFFF, U+2600-27BF,
+# ZWJ, U+FE00-FE3F). Curly quotes and dashes, the usual non-ASCII in replies, don't match
+_EMOJI_UTF8_RE = re.compile(rb"\xf0\x9f|\xe2(?:[\x98-\x9e]|\x80\x8d)|\xef\xb8")
+# Markdown formatting, replaced by its inner text. Bold goes before italic, or the italic
+# pattern would pair a lone "*" ("2*3") with the first "*" of a later "**bold**"
 _MARKDOWN_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
 _MARKDOWN_ITALIC_RE = re.compile(r"\*(.+?)\*")
 _MARKDOWN_ITALIC2_RE = re.compile(r"_(.+?)_")
 _MARKDOWN_CODE_RE = re.compile(r"`(.+?)`")
-_MARKDOWN_HEADER_RE = re.compile(r"^#{1,6}\s+", re.MULTILINE)
-_MARKDOWN_BULLET_RE = re.compile(r"^[\s]*[-*+]\s+", re.MULTILINE)
-_MARKDOWN_NUMBERED_RE = re.compile(r"^[\s]*\d+\.\s+", re.MULTILINE)
-_URL_RE = re.compile(r"https?://\S+")
-_EMOJI_RE = re.compile(
-    "["
-    "\U0001F600-\U0001F64F"  # emoticons
-    "\U0001F300-\U0001F5FF"  # symbols & pictographs
-    "\U0001F680-\U0001F6FF"  # transport & map symbols
-    "\U0001F1E0-\U0001F1FF"  # flags
-    "\U00002702-\U000027B0"  # dingbats
-    "\U0001F900-\U0001F9FF"  # supplemental symbols
-    "\U0001FA00-\U0001FA6F"  # chess symbols
-    "\U0001FA70-\U0001FAFF"  # symbols extended-A
-    "\U00002600-\U000026FF"  # misc symbols
-    "\U0000FE00-\U0000FE0F"  # variation selectors
-    "\U0000200D"             # zero width joiner
-    "]+",
-    re.UNICODE,
-)
-_MULTI_SPACE_RE = re.compile(r"[ \t]+")
+# Single spaces are already what they'd be replaced with, so only runs and tabs match
+_MULTI_SPACE_RE = re.compile(r" [ \t]+|\t[ \t]*")
 _MULTI_NEWLINE_RE = re.compile(r"\n{2,}")
-# Strip emotion tags that Chatterbox supported but Kokoro does not
-_EMOTION_TAG_RE = re.compile(
-    r"\[(laugh|chuckle|cough|sigh|gasp|sniff|groan|shush|clear throat|pause)\]",
-    re.IGNORECASE,
-)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+# Horizontal rules ("***", "* * *", "---") and bare markers left alone on a line
+_MARKER_LINE_RE = re.compile(r"\s*[-#*+][-#*+\s]*")
+# Bound once, so the per-reply calls skip the attribute lookup
+_think_sub = _THINK_RE.sub
+_emotion_tag_sub = _EMOTION_TAG_RE.sub
+_url_sub = _URL_RE.sub
+_emoji_sub = _EMOJI_RE.sub
+_bold_sub = _MARKDOWN_BOLD_RE.sub
+_italic_sub = _MARKDOWN_ITALIC_RE.sub
+_italic2_sub = _MARKDOWN_ITALIC2_RE.sub
+_code_sub = _MARKDOWN_CODE_RE.sub
+_multi_space_sub = _MULTI_SPACE_RE.sub
+_multi_newline_sub = _MULTI_NEWLINE_RE.sub
+_split_sentences = _SENTENCE_END_RE.split
+_marker_line_match = _MARKER_LINE_RE.fullmatch
+_emoji_utf8_search = _EMOJI_UTF8_RE.search
+
+# Canonical 44-byte WAV header: RIFF, fmt and data chunk headers
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAV_HDR = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+
+def _may_have_spans(text: str) -> bool:
+    # Every span pass needs one of these; each `in` is a C substring search, far
+    # cheaper than the regex VM concluding there's no match
+    return "*" in text or "_" in text or "`" in text or "<" in text or "[" in text or "://" in text
+
+
+def _strip_line_prefix(line: str) -> str:
+    """Drop a markdown header ("## "), then a bullet ("- ", "* ", "+ "), then a list number ("1. ").
+
+    A line of nothing but markers is dropped whole, since there's no text after the prefix.
+    """
+    if _marker_line_match(line):
+        return ""
+    if line[:1] == "#":
+        hashes = len(line) - len(line.lstrip("#"))
+        if hashes <= 6 and line[hashes:hashes + 1].isspace():
+            line = line[hashes:].lstrip()
+    rest = line.lstrip()
+    if rest[:1] in ("-", "*", "+") and rest[1:2].isspace():
+        line = rest = rest[1:].lstrip()
+    if rest[:1].isdecimal():
+        digits = 1
+        while rest[digits:digits + 1].isdecimal():
+            digits += 1
+        if rest[digits:digits + 1] == "." and rest[digits + 1:digits + 2].isspace():
+            line = rest[digits + 1:].lstrip()
+    return line
+
+
+def _strip_line_prefixes(text: str) -> str:
+    # Prose lines start with a letter, which no prefix does, and skip the call entirely
+    return "\n".join([line if line[:1].isalpha() else _strip_line_prefix(line) for line in text.split("\n")])
+
+
+def _strip_emoji(text: str) -> str:
+    if text.isascii():
+        return text
+    if len(text) >= _EMOJI_MASK_MIN_CHARS:
+        codepoints = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        emoji = _EMOJI_MASK[np.minimum(codepoints, 0x1FFFF)]  # 0x1FFFF is not an emoji
+        if not emoji.any():
+            return text
+        return codepoints[~emoji].tobytes().decode("utf-32-le", "surrogatepass")
+    # Encoding is a C loop; searching the bytes for emoji lead sequences is far cheaper
+    # than trying the emoji class at every position
+    if _emoji_utf8_search(text.encode("utf-8", "surrogatepass")) is None:
+        return text
+    return _emoji_sub("", text)
+
+
+def _sentence_batches(text: str) -> list[str]:
+    """Split text at sentence ends into batches of at least TTS_BATCH_CHARS (the last may be shorter)."""
+    batches = []
+    batch = ""
+    for sentence in _split_sentences(text):
+        batch = f"{batch} {sentence}" if batch else sentence
+        if len(batch) >= TTS_BATCH_CHARS:
+            batches.append(batch)
+            batch = ""
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _clean_spans(text: str) -> str:
+    """Drop thinking blocks, emotion tags, URLs and emoji, then unwrap inline markdown.
+
+    Each pass is skipped when a substring check shows it has nothing to match.
+    """
+    if "<think>" in text:
+        text = _think_sub("", text)
+    if "[" in text:
+        text = _emotion_tag_sub("", text)
+    if "://" in text:
+        text = _url_sub("", text)
+    text = _strip_emoji(text)
+    if "**" in text:
+        text = _bold_sub(r"\1", text)
+    if "*" in text:
+        text = _italic_sub(r"\1", text)
+    if "_" in text:
+        text = _italic2_sub(r"\1", text)
+    if "`" in text:
+        text = _code_sub(r"\1", text)
+    return text
+
 
 # Available Kokoro voices
 KOKORO_VOICES = {
@@ -75,19 +205,23 @@ KOKORO_VOICES = {
 
 
 class TTSService:
-    def __init__(self):
+    def __init__(self, float_pcm: bool = TTS_FLOAT_WAV):
         self._pipeline = None
+        # One pipeline per language code, so switching accents back and forth doesn't reload
+        self._pipelines: dict[str, object] = {}
         self._sample_rate: int = 24000
         self._voice: str = TTS_VOICE
+        # Float WAV carries Kokoro's float32 samples as-is; browsers decode it natively
+        self._float_pcm = float_pcm
+        # bytes are immutable, so every empty turn can share one silent WAV
+        self._silent_cache: dict[tuple[int, int], bytes] = {}
 
     def load(self):
         """Load Kokoro TTS pipeline."""
         try:
-            from kokoro import KPipeline
-
             lang_code = TTS_LANG_CODE
             logger.info("Loading Kokoro TTS (lang=%s, voice=%s)...", lang_code, self._voice)
-            self._pipeline = KPipeline(lang_code=lang_code, repo_id="hexgrad/Kokoro-82M")
+            self._pipeline = self._get_pipeline(lang_code)
             logger.info("Kokoro TTS loaded, sample_rate=%d", self._sample_rate)
         except Exception:
             logger.exception("Failed to load Kokoro TTS")
@@ -103,16 +237,29 @@ class TTSService:
         if not text.strip():
             return self._silent_wav()
 
-        # Kokoro yields chunks — collect all and concatenate
-        audio_chunks = []
-        for _graphemes, _phonemes, audio_chunk in self._pipeline(text, voice=self._voice):
-            audio_chunks.append(audio_chunk.numpy())
+        # Read once, so a voice change mid-reply can't mix voices across batches
+        pipeline, voice = self._pipeline, self._voice
+        batches = _sentence_batches(text) if _synth_executor and len(text) >= TTS_PARALLEL_MIN_CHARS else []
+        if len(batches) > 1:
+            # map() yields results in submission order, so the audio reassembles in order
+            parts = list(_synth_executor.map(lambda batch: self._synthesize_pcm(pipeline, voice, batch), batches))
+        else:
+            parts = [self._synthesize_pcm(pipeline, voice, text)]
 
-        if not audio_chunks:
+        if not any(parts):
             return self._silent_wav()
 
-        wav_np = np.concatenate(audio_chunks)
-        return self._float_to_wav(wav_np)
+        return self._pcm_to_wav(*parts)
+
+    def _synthesize_pcm(self, pipeline, voice: str, text: str) -> bytearray:
+        """Run Kokoro over cleaned text and return the raw sample bytes."""
+        # Kokoro yields chunks — convert each as it arrives and append its sample bytes,
+        # so the float waveform is never concatenated
+        to_samples = self._chunk_to_float32 if self._float_pcm else self._chunk_to_pcm16
+        pcm = bytearray()
+        for _graphemes, _phonemes, audio_chunk in pipeline(text, voice=voice):
+            pcm += memoryview(to_samples(audio_chunk))
+        return pcm
 
     def set_voice(self, voice: str):
         """Change the active voice."""
@@ -127,59 +274,90 @@ class TTSService:
         logger.info("Voice set to: %s (%s)", voice, KOKORO_VOICES[voice])
 
         if new_lang != old_lang and self._pipeline is not None:
-            logger.info("Accent changed, reloading pipeline with lang_code=%s", new_lang)
+            logger.info("Accent changed, switching pipeline to lang_code=%s", new_lang)
+            self._pipeline = self._get_pipeline(new_lang)
+
+    def _get_pipeline(self, lang_code: str):
+        """Kokoro pipeline for lang_code, built on first use and kept afterwards."""
+        pipeline = self._pipelines.get(lang_code)
+        if pipeline is None:
             from kokoro import KPipeline
-            self._pipeline = KPipeline(lang_code=new_lang, repo_id="hexgrad/Kokoro-82M")
+
+            # Pipelines differ only in their G2P, so later ones share the first one's model weights
+            model = next(iter(self._pipelines.values())).model if self._pipelines else True
+            pipeline = KPipeline(lang_code=lang_code, repo_id="hexgrad/Kokoro-82M", model=model)
+            self._pipelines[lang_code] = pipeline
+        return pipeline
 
     @staticmethod
     def _clean_for_tts(text: str) -> str:
         """Clean text for natural-sounding TTS output."""
-        # Strip thinking blocks
-        text = _THINK_RE.sub("", text)
-        # Remove emotion tags (Kokoro doesn't support them)
-        text = _EMOTION_TAG_RE.sub("", text)
-        # Remove URLs
-        text = _URL_RE.sub("", text)
-        # Remove emojis
-        text = _EMOJI_RE.sub("", text)
-        # Remove markdown formatting (keep the inner text)
-        text = _MARKDOWN_BOLD_RE.sub(r"\1", text)
-        text = _MARKDOWN_ITALIC_RE.sub(r"\1", text)
-        text = _MARKDOWN_ITALIC2_RE.sub(r"\1", text)
-        text = _MARKDOWN_CODE_RE.sub(r"\1", text)
-        text = _MARKDOWN_HEADER_RE.sub("", text)
-        text = _MARKDOWN_BULLET_RE.sub("", text)
-        text = _MARKDOWN_NUMBERED_RE.sub("", text)
+        # Short plain replies ("Sure, here you go.") only ever need whitespace collapsed
+        if not (text.isascii() and "\n" not in text and text[:1].isalpha() and not _may_have_spans(text)):
+            # Strip thinking blocks, emotion tags, URLs, emojis and inline markdown
+            text = _clean_spans(text)
+            # Then line prefixes, including ones a removed span exposed ("[laugh] - item")
+            text = _strip_line_prefixes(text)
         # Collapse whitespace
-        text = _MULTI_SPACE_RE.sub(" ", text)
-        text = _MULTI_NEWLINE_RE.sub(". ", text)
+        if "  " in text or "\t" in text:
+            text = _multi_space_sub(" ", text)
+        if "\n\n" in text:
+            text = _multi_newline_sub(". ", text)
         return text.strip()
 
-    def _float_to_wav(self, wav_np: np.ndarray) -> bytes:
-        """Convert float32 audio array to WAV bytes."""
-        # Convert float32 [-1, 1] to int16 PCM
-        wav_np = np.clip(wav_np, -1.0, 1.0)
-        pcm16 = (wav_np * 32767).astype(np.int16)
+    @classmethod
+    def _chunk_to_pcm16(cls, audio) -> np.ndarray:
+        """Convert one Kokoro audio chunk (a torch tensor) to int16 PCM.
+
+        Quantizing on the tensor's own device means a GPU copies back half the bytes.
+        """
+        if isinstance(audio, np.ndarray):
+            return cls._float_to_pcm16(audio)
+        return audio.clamp(-1.0, 1.0).mul_(32767).short().cpu().numpy()
+
+    @staticmethod
+    def _chunk_to_float32(audio) -> np.ndarray:
+        """Kokoro audio chunk as contiguous float32 samples, unclipped."""
+        if not isinstance(audio, np.ndarray):
+            audio = audio.cpu().numpy()
+        return np.ascontiguousarray(audio, dtype=np.float32)
+
+    @staticmethod
+    def _float_to_pcm16(wav_np: np.ndarray) -> np.ndarray:
+        """Convert float32 [-1, 1] audio to int16 PCM. Clips wav_np in place."""
+        # Clip in place, then scale straight into the int16 buffer, so no float
+        # temporaries are allocated
+        np.clip(wav_np, -1.0, 1.0, out=wav_np)
+        pcm16 = np.empty(wav_np.shape, dtype=np.int16)
+        np.multiply(wav_np, 32767, out=pcm16, casting="unsafe")
+        return pcm16
+
+    def _pcm_to_wav(self, *parts: bytes | bytearray) -> bytes:
+        """Wrap mono sample bytes (int16, or float32 with float_pcm) in a WAV container.
 
-        buf = io.BytesIO()
-        with wave.open(buf, "wb") as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(self._sample_rate)
-            wf.writeframes(pcm16.tobytes())
-        return buf.getvalue()
+        The parts are joined straight after the header, so batched audio is copied once.
+        """
+        data_len = sum(map(len, parts))
+        if self._float_pcm:
+            fmt, width = _WAVE_FORMAT_IEEE_FLOAT, 4
+        else:
+            fmt, width = _WAVE_FORMAT_PCM, 2
+        header = _WAV_HDR.pack(
+            b"RIFF", 36 + data_len, b"WAVE",
+            b"fmt ", 16, fmt, 1, self._sample_rate, self._sample_rate * width, width, 8 * width,  # mono
+            b"data", data_len,
+        )
+        return b"".join((header, *parts))
 
     def _silent_wav(self, duration_ms: int = 100) -> bytes:
-        """Generate a short silent WAV for empty text."""
-        n_samples = int(self._sample_rate * duration_ms / 1000)
-        silence = np.zeros(n_samples, dtype=np.int16)
-        buf = io.BytesIO()
-        with wave.open(buf, "wb") as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(self._sample_rate)
-            wf.writeframes(silence.tobytes())
-        return buf.getvalue()
+        """Short silent WAV for empty text, built once per (sample rate, duration)."""
+        key = (self._sample_rate, duration_ms)
+        wav = self._silent_cache.get(key)
+        if wav is None:
+            n_samples = int(self._sample_rate * duration_ms / 1000)
+            # All-zero bytes are silence in both int16 and float32
+            wav = self._silent_cache[key] = self._pcm_to_wav(bytes((4 if self._float_pcm else 2) * n_samples))
+        return wav
 
 
 tts_service = TTSService()
@@ -14,6 +14,9 @@ interface WSMessage {
   session_id?: string;
 }
 
+const AUDIO_FRAME_TYPE = 0x01;
+const AUDIO_FRAME_HEADER_SIZE = 5;
+
 export function useWebSocket() {
   const wsRef = useRef<WebSocket | null>(null);
   const [connected, setConnected] = useState(false);
@@ -47,6 +50,8 @@ export function useWebSocket() {
       if (typeof event.data === "string") {
         const msg: WSMessage = JSON.parse(event.data);
         handleMessage(msg);
+      } else if (event.data instanceof ArrayBuffer) {
+        handleBinaryFrame(event.data);
       }
     };
 
@@ -123,6 +128,16 @@ export function useWebSocket() {
     [addMessage, setStage]
   );
 
+  // Binary frame layout: [type: u8][index: u32 BE][payload]
+  const handleBinaryFrame = useCallback((buffer: ArrayBuffer) => {
+    if (buffer.byteLength < AUDIO_FRAME_HEADER_SIZE) return;
+    const view = new DataView(buffer);
+    if (view.getUint8(0) === AUDIO_FRAME_TYPE) {
+      const wav = buffer.slice(AUDIO_FRAME_HEADER_SIZE);
+      playAudio(new Blob([wav], { type: "audio/wav" }));
+    }
+  }, []);
+
   const playAudio = useCallback((blob: Blob) => {
     audioQueueRef.current.push(blob);
     if (!playingRef.current) {